@@ -0,0 +1,435 @@
+import argparse
+import datetime
+import gc
+import importlib.util
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import psutil
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# (attributes, values per attribute), smallest first
+SIZES = [(3, 5), (5, 10), (8, 12), (10, 15), (12, 20), (15, 20)]
+QUICK_SIZES = SIZES[:3]
+
+RESULTS_FILENAME = 'output/bench-results.json'
+# Kept out of output/ so a machine's baseline can be committed alongside the code
+BASELINE_FILENAME = 'bench/baseline.json'
+
+# RSS differences below this are never reported as regressions
+MEMORY_SLACK = 1024 * 1024
+
+
+class NullFile:
+    """A file that drops everything, so the benchmarks time generation rather than the disk."""
+
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class Enough(Exception):
+    """Stops a walk that has no row limit of its own once a benchmark has its rows."""
+
+
+def load_script(filename):
+    """Import one of the repo's scripts as a module (sku-new.py isn't an importable name)."""
+    name = os.path.splitext(filename)[0].replace('-', '_')
+    if name in sys.modules:
+        return sys.modules[name]
+    if HERE not in sys.path:
+        sys.path.insert(0, HERE)
+    spec = importlib.util.spec_from_file_location(name, os.path.join(HERE, filename))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def synthetic_attributes(attribute_count, value_count, seed=1):
+    """Build attributes in the scripts' list-of-dicts form, with the first half required.
+
+    Values are unique across attributes and prices are whole numbers from a seeded
+    generator, so every run and every machine benchmarks the same catalog.
+    """
+    generator = random.Random(seed * 1000003 + attribute_count * 101 + value_count)
+    required = (attribute_count + 1) // 2
+    return [
+        {
+            'name': f"A{a}",
+            'enabled': True,
+            'required': a < required,
+            'values': [{'value': f"A{a}V{v}", 'price': generator.randint(0, 500)} for v in range(value_count)],
+        }
+        for a in range(attribute_count)
+    ]
+
+
+def value_sets(attributes):
+    sets = [[value['value'] for value in attribute['values']] for attribute in attributes]
+    required_sets = [values for values, attribute in zip(sets, attributes) if attribute['required']]
+    return sets, required_sets
+
+
+def drain(walk, rows, consume):
+    """Feed consume() rows from walk() until rows rows were used, restarting the walk as often as needed."""
+    done = 0
+    while done < rows:
+        passed = 0
+        for item in itertools.islice(walk(), rows - done):
+            consume(item)
+            passed += 1
+        if not passed:
+            break
+        done += passed
+    return done
+
+
+def bench_sku(attributes, rows):
+    sku = load_script('sku.py')
+    sku_generator = sku.GenerateSku([], {})
+    sets = value_sets(attributes)[0]
+    writer = sku.BlockWriter(NullFile(), echo=False)
+    done = drain(lambda: sku_generator.generate_combinations(sets), rows, writer.write)
+    writer.flush()
+    return done
+
+
+def bench_sku_new(attributes, rows):
+    sku_new = load_script('sku-new.py')
+    sku_generator = sku_new.GenerateSku(attributes, {})
+    required_sets, optional_sets = sku_generator.extract_values()
+    writer = sku_new.BlockWriter(NullFile(), echo=False)
+    done = drain(lambda: sku_generator.generate_combinations(required_sets, optional_sets), rows, writer.write)
+    writer.flush()
+    return done
+
+
+def bench_sku_new_bytes(attributes, rows):
+    sku_new = load_script('sku-new.py')
+    sku_generator = sku_new.GenerateSku(attributes, {})
+    required_sets, optional_sets = sku_generator.extract_values()
+    done = 0
+
+    def write(block):
+        nonlocal done
+        done += block.count(b'\n')
+        if done >= rows:
+            raise Enough
+
+    while done < rows:
+        before = done
+        try:
+            sku_generator.write_combinations(required_sets, optional_sets, write)
+        except Enough:
+            break
+        if done == before:
+            break
+    return done
+
+
+def price_generator(attributes, price_mode='float'):
+    price = load_script('price.py')
+    sku_generator = price.GenerateSku(attributes)
+    sku_generator.options['priceMode'] = price_mode
+    return price, sku_generator
+
+
+def bench_price_blocks(attributes, rows, price_mode='float'):
+    price, sku_generator = price_generator(attributes, price_mode)
+    sets, required_sets = value_sets(attributes)
+    writer = price.BlockWriter(NullFile(), echo=False)
+    done = 0
+    while done < rows:
+        before = done
+        for block in sku_generator.generate_record_blocks(sets, required_sets):
+            writer.write_block(price.format_block(sku_generator, block))
+            done += len(block)
+            if done >= rows:
+                break
+        if done == before:
+            break
+    return done
+
+
+def bench_price_cents(attributes, rows):
+    return bench_price_blocks(attributes, rows, 'cents')
+
+
+def bench_price_calculate(attributes, rows):
+    _, sku_generator = price_generator(attributes)
+    sets = value_sets(attributes)[0]
+    return drain(lambda: itertools.product(*sets), rows, sku_generator.calculate_price)
+
+
+def bench_price_stats(attributes, rows):
+    _, sku_generator = price_generator(attributes)
+    sets, required_sets = value_sets(attributes)
+    return sku_generator.price_stats(sets, required_sets)['count']
+
+
+def bench_price_top(attributes, rows):
+    _, sku_generator = price_generator(attributes)
+    sets, required_sets = value_sets(attributes)
+    return len(sku_generator.top_k(sets, required_sets, 1000))
+
+
+# name: (function, whether it produces rows at a measurable rate)
+PATHS = {
+    'sku': (bench_sku, True),
+    'sku-new': (bench_sku_new, True),
+    'sku-new-bytes': (bench_sku_new_bytes, True),
+    'price-blocks': (bench_price_blocks, True),
+    'price-cents': (bench_price_cents, True),
+    'price-calculate': (bench_price_calculate, True),
+    'price-stats': (bench_price_stats, False),
+    'price-top': (bench_price_top, False),
+}
+
+
+def peak_rss():
+    if resource is None:
+        return psutil.Process(os.getpid()).memory_info().rss
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def calibrate(rounds=5):
+    """Time a fixed pure-Python workload (best of rounds) as this machine's current speed.
+
+    Results are compared in units of it, so a box that is slower today (CPU
+    frequency, noisy neighbours) doesn't read as a regression in the code.
+    """
+    best = float('inf')
+    for _ in range(rounds):
+        started = time.perf_counter()
+        table = {f"V{i}": i for i in range(2000)}
+        total = 0
+        for i in range(20000):
+            key = f"V{i % 2000}"
+            total += table[key]
+            '-'.join((key, key, key))
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def run_case(path, attribute_count, value_count, rows):
+    """Run one benchmark in this process and return its measurements."""
+    function, rated = PATHS[path]
+    attributes = synthetic_attributes(attribute_count, value_count)
+    # Import outside the timed part
+    if path.startswith('price'):
+        load_script('price.py')
+    else:
+        load_script('sku-new.py' if path.startswith('sku-new') else 'sku.py')
+
+    calibration = calibrate()
+    gc.collect()
+    rss_before = psutil.Process(os.getpid()).memory_info().rss
+    started = time.perf_counter()
+    result = function(attributes, rows)
+    seconds = time.perf_counter() - started
+    peak = peak_rss()
+    return {
+        'path': path,
+        'attributes': attribute_count,
+        'values': value_count,
+        'rows': result if rated else 0,
+        'result': None if rated else result,
+        'seconds': seconds,
+        'rowsPerSecond': result / seconds if rated and seconds else None,
+        # Time in units of the calibration workload, comparable across machine speeds
+        'normalized': (seconds / result if rated and result else seconds) / calibration,
+        'calibration': calibration,
+        'peakRss': peak,
+        'rssGrowth': max(0, peak - rss_before),
+    }
+
+
+def measure(path, attribute_count, value_count, rows, repeat):
+    """Run a case repeat times, each in a fresh interpreter; keep the best time and the highest peak."""
+    runs = []
+    for _ in range(repeat):
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--case', path,
+             '--size', f"{attribute_count}x{value_count}", '--rows', str(rows)],
+            capture_output=True, text=True, check=True, cwd=HERE,
+        )
+        runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    best = min(runs, key=lambda run: run['normalized'])
+    best['peakRss'] = max(run['peakRss'] for run in runs)
+    best['rssGrowth'] = max(run['rssGrowth'] for run in runs)
+    best['repeat'] = repeat
+    return best
+
+
+def case_key(result):
+    return f"{result['path']} {result['attributes']}x{result['values']}"
+
+
+def compare(results, baseline, tolerance):
+    """Mark every result against the baseline; return the regressions."""
+    previous = {case_key(result): result for result in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        before = previous.get(case_key(result))
+        result['status'] = 'new'
+        if before is None:
+            continue
+        # Normalized time is per row for the generating paths, so a different --rows still compares
+        slowdown = result['normalized'] / before['normalized'] if before.get('normalized') else 1.0
+        result['slowdown'] = slowdown
+        result['peakRssChange'] = result['peakRss'] - before['peakRss']
+
+        problems = []
+        if slowdown > 1 + tolerance:
+            problems.append(f"{slowdown:.2f}x slower")
+        if (result['peakRss'] > before['peakRss'] * (1 + tolerance)
+                and result['peakRssChange'] > MEMORY_SLACK):
+            problems.append(f"peak RSS +{result['peakRssChange'] / 1024 ** 2:.1f} MB")
+        if problems:
+            result['status'] = 'REGRESSION: ' + ', '.join(problems)
+            regressions.append(result)
+        elif slowdown < 1 - tolerance:
+            result['status'] = f"{1 / slowdown:.2f}x faster"
+        else:
+            result['status'] = 'ok'
+    return regressions
+
+
+def machine():
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def format_result(result):
+    rate = f"{result['rowsPerSecond']:>12,.0f} rows/s" if result['rowsPerSecond'] else f"{'':>19}"
+    return (f"{case_key(result):<24} {result['seconds']:>9.4f}s {rate} "
+            f"{result['peakRss'] / 1024 ** 2:>7.1f} MB peak  {result.get('status', '')}")
+
+
+def parse_sizes(text):
+    sizes = []
+    for size in text.split(','):
+        try:
+            attribute_count, value_count = (int(part) for part in size.lower().split('x'))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"sizes look like 3x5,15x20, not {text!r}") from None
+        sizes.append((attribute_count, value_count))
+    return sizes
+
+
+def parse_paths(text):
+    paths = text.split(',')
+    unknown = [path for path in paths if path not in PATHS]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown paths {', '.join(unknown)}; choose from {', '.join(PATHS)}")
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the sku.py, sku-new.py and price.py paths on synthetic catalogs."
+    )
+    parser.add_argument('--sizes', type=parse_sizes, metavar='AxV,...',
+                        help="catalog sizes as attributes x values (default: 3x5,5x10,8x12,10x15,12x20,15x20)")
+    parser.add_argument('--paths', type=parse_paths, default=list(PATHS), metavar='NAME,...',
+                        help=f"paths to run (default: all of {', '.join(PATHS)})")
+    parser.add_argument('--rows', type=int, default=300000,
+                        help="rows per run of a generating path; small catalogs are walked again (default: 300000)")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per case; the best time counts (default: 3)")
+    parser.add_argument('--quick', action='store_true', help="only the three smallest sizes, one run each")
+    parser.add_argument('--baseline', default=BASELINE_FILENAME, metavar='PATH',
+                        help=f"baseline to compare against (default: {BASELINE_FILENAME})")
+    parser.add_argument('--save-baseline', action='store_true', help="save this run as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="slowdown or peak RSS growth flagged as a regression (default: 0.25)")
+    parser.add_argument('--output', default=RESULTS_FILENAME, metavar='PATH',
+                        help=f"where to write the results (default: {RESULTS_FILENAME})")
+    parser.add_argument('--case', choices=list(PATHS), help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=parse_sizes, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        # Child process: run one case and report it on stdout
+        (attribute_count, value_count), = args.size
+        print(json.dumps(run_case(args.case, attribute_count, value_count, args.rows)))
+        return 0
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else SIZES)
+    repeat = 1 if args.quick else args.repeat
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline.get('machine') != machine():
+            print(f"Warning: {args.baseline} was recorded on a different machine or Python; "
+                  "timings may not be comparable")
+
+    results = []
+    for attribute_count, value_count in sizes:
+        for path in args.paths:
+            try:
+                result = measure(path, attribute_count, value_count, args.rows, repeat)
+            except subprocess.CalledProcessError as e:
+                print(f"{path} {attribute_count}x{value_count} failed:\n{e.stderr}")
+                return 1
+            results.append(result)
+            if baseline is None:
+                print(format_result(result))
+
+    regressions = []
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            # Measure suspects again, so one noisy pass doesn't fail the run; the better measurement counts
+            for index, result in enumerate(results):
+                if result in regressions:
+                    again = measure(result['path'], result['attributes'], result['values'], args.rows, repeat)
+                    if again['normalized'] < result['normalized']:
+                        results[index] = again
+            regressions = compare(results, baseline, args.tolerance)
+        for result in results:
+            print(format_result(result))
+
+    report = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'machine': machine(),
+        'rows': args.rows,
+        'repeat': repeat,
+        'results': results,
+    }
+    filename = args.baseline if args.save_baseline else args.output
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    with open(filename, 'w') as file:
+        json.dump(report, file, indent=4)
+    print(f"{'Baseline' if args.save_baseline else 'Results'} written to {filename}")
+
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
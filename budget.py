@@ -0,0 +1,118 @@
+import gc
+import os
+import sys
+
+import psutil
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MB = 1024 * 1024
+
+
+class MemoryBudgetExceeded(Exception):
+    """Raised when RSS stays over the memory limit after the writer has given back what it can."""
+
+    def __init__(self, rss, limit):
+        super().__init__(f"memory limit exceeded: {rss / MB:.1f} MB in use (limit {limit / MB:.0f} MB)")
+        self.rss = rss
+        self.limit = limit
+
+
+class MemoryBudget:
+    """Split a --memory-limit between the pieces of a generation run that hold memory.
+
+    The headroom is the limit minus the RSS at start-up (interpreter, modules,
+    attribute data). The write buffer, the rows joined per block and any caches
+    each get a share of it, never more than their usual defaults. check() is
+    called once per written block: when RSS is over the limit it asks the writer
+    to relieve the pressure (flush, shrink its batches) and raises
+    MemoryBudgetExceeded only when that isn't enough, so the caller can stop at a
+    block boundary with its output intact.
+    """
+
+    # Shares of the headroom
+    BUFFER_SHARE = 1 / 8
+    BATCH_SHARE = 1 / 8
+    CACHE_SHARE = 1 / 16
+
+    # Rough in-memory cost of one queued row: str object, list slot and its share of the join
+    ROW_BYTES = 256
+
+    MIN_BUFFER_SIZE = 64 * 1024
+    MIN_BATCH_ROWS = 64
+
+    def __init__(self, limit_mb=None):
+        self.limit = int(limit_mb * MB) if limit_mb else None
+        self.process = psutil.Process(os.getpid())
+        self.peak = 0
+        self.pressure = 0
+        self.baseline = self.rss()
+        if self.limit is not None and self.baseline >= self.limit:
+            raise ValueError(
+                f"--memory-limit {limit_mb} MB is below the {self.baseline / MB:.1f} MB already in use"
+            )
+
+    @property
+    def headroom(self):
+        return None if self.limit is None else self.limit - self.baseline
+
+    def buffer_size(self, default=1024 * 1024):
+        """Bytes for the output file buffer."""
+        if self.limit is None:
+            return default
+        return int(min(default, max(self.MIN_BUFFER_SIZE, self.headroom * self.BUFFER_SHARE)))
+
+    def batch_rows(self, default=4096):
+        """Rows to queue before joining them into one write."""
+        if self.limit is None:
+            return default
+        return int(min(default, max(self.MIN_BATCH_ROWS, self.headroom * self.BATCH_SHARE // self.ROW_BYTES)))
+
+    def cache_items(self, item_bytes, default):
+        """Entries a cache of item_bytes-sized entries may hold."""
+        if self.limit is None:
+            return default
+        return int(min(default, max(1, self.headroom * self.CACHE_SHARE // item_bytes)))
+
+    def rss(self):
+        rss = self.process.memory_info().rss
+        if rss > self.peak:
+            self.peak = rss
+        return rss
+
+    def check(self, relieve=None):
+        """Apply backpressure when RSS is over the limit.
+
+        relieve() should release what it can and return True, or return False when
+        it has nothing left to give. Raises MemoryBudgetExceeded when RSS is still
+        over the limit afterwards.
+        """
+        if self.limit is None or self.rss() <= self.limit:
+            return
+        self.pressure += 1
+        while relieve is not None and relieve():
+            gc.collect()
+            if self.rss() <= self.limit:
+                return
+        gc.collect()
+        rss = self.rss()
+        if rss > self.limit:
+            raise MemoryBudgetExceeded(rss, self.limit)
+
+    def peak_rss(self):
+        """Peak RSS of the process, from the kernel when available, else from our samples."""
+        peak = self.peak
+        if resource is not None:
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # Linux reports kilobytes, macOS bytes
+            peak = max(peak, maxrss if sys.platform == 'darwin' else maxrss * 1024)
+        return peak
+
+    def report(self):
+        summary = f"Peak RSS: {self.peak_rss() / MB:.1f} MB"
+        if self.limit is not None:
+            summary += f" (limit {self.limit / MB:.0f} MB, backpressure {self.pressure} times)"
+        return summary
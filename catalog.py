@@ -0,0 +1,230 @@
+import hashlib
+import json
+import os
+import sys
+from array import array
+from decimal import Decimal, InvalidOperation
+
+# Bump when the compiled layout changes so stale cache files are ignored
+COMPILED_VERSION = 2
+
+# Attribute flags
+ENABLED = 1
+REQUIRED = 2
+
+# data.json spellings of the price adjustment types
+ADJUSTMENT_TYPES = {
+    'percent': 'percentage',
+    'percentage': 'percentage',
+    'fixed': 'fixed',
+    'flat': 'fixed',
+    'amount': 'fixed',
+}
+
+
+class Catalog:
+    """Compiled form of a data.json catalog.
+
+    Value strings are interned, prices are integer cents in array('q') per attribute
+    and each attribute's enabled/required state is a bit in flags. options uses the
+    GenerateSku option names (separator, prefixName, basePrice, ...).
+    """
+
+    def __init__(self, source_hash, options, names, values, prices, flags):
+        self.source_hash = source_hash
+        self.options = options
+        self.names = names
+        self.values = values
+        self.prices = prices
+        self.flags = flags
+
+    def attributes(self):
+        """Return the attributes in the list-of-dicts form the scripts embed."""
+        return [
+            {
+                'name': name,
+                'enabled': bool(flags & ENABLED),
+                'required': bool(flags & REQUIRED),
+                'values': [{'value': value, 'price': cents / 100} for value, cents in zip(values, prices)],
+            }
+            for name, values, prices, flags in zip(self.names, self.values, self.prices, self.flags)
+        ]
+
+    def cent_tables(self):
+        """Return a value -> integer cents table per attribute, straight from the compiled prices."""
+        return [dict(zip(values, prices)) for values, prices in zip(self.values, self.prices)]
+
+    def sets(self):
+        """Return (sets, required_sets) for the enabled attributes with values."""
+        sets = []
+        required_sets = []
+        for values, flags in zip(self.values, self.flags):
+            if flags & ENABLED and values:
+                values = list(values)
+                sets.append(values)
+                if flags & REQUIRED:
+                    required_sets.append(values)
+        return sets, required_sets
+
+
+def load_catalog(filename='data/data.json', cache_dir=None):
+    """Load a catalog, using the compiled cache when the JSON hasn't changed.
+
+    The cache lives in <json dir>/.cache by default, keyed by the SHA-256 of the
+    JSON bytes, so editing the file or changing COMPILED_VERSION recompiles it.
+    """
+    with open(filename, 'rb') as file:
+        raw = file.read()
+    source_hash = hashlib.sha256(raw).hexdigest()
+
+    cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(filename)), '.cache')
+    cache_filename = os.path.join(cache_dir, f"catalog-v{COMPILED_VERSION}-{source_hash[:32]}.json")
+    try:
+        with open(cache_filename, 'rb') as cache:
+            return read_cache(json.load(cache), source_hash)
+    except (OSError, ValueError, TypeError, KeyError, OverflowError):
+        pass
+
+    catalog = compile_catalog(json.loads(raw), source_hash)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        temporary = f"{cache_filename}.{os.getpid()}.tmp"
+        with open(temporary, 'w') as cache:
+            json.dump(write_cache(catalog), cache)
+        os.replace(temporary, cache_filename)
+    except OSError:
+        pass  # A read-only checkout still works, just without the cache
+    return catalog
+
+
+def write_cache(catalog):
+    """Return the compiled catalog as plain JSON data for the cache file."""
+    return {
+        'sourceHash': catalog.source_hash,
+        'options': catalog.options,
+        'names': catalog.names,
+        'values': [list(values) for values in catalog.values],
+        'prices': [prices.tolist() for prices in catalog.prices],
+        'flags': catalog.flags.tolist(),
+    }
+
+
+def read_cache(data, source_hash):
+    """Rebuild a Catalog from write_cache data; raises ValueError if it isn't for this source."""
+    if data['sourceHash'] != source_hash:
+        raise ValueError("catalog cache is for a different source")
+    names, values, prices, flags = data['names'], data['values'], data['prices'], data['flags']
+    if not isinstance(data['options'], dict) or not len(names) == len(values) == len(prices) == len(flags):
+        raise ValueError("catalog cache is malformed")
+    if any(not isinstance(entries, list) or len(entries) != len(costs) for entries, costs in zip(values, prices)):
+        raise ValueError("catalog cache is malformed")
+    return Catalog(
+        source_hash,
+        data['options'],
+        [sys.intern(name) for name in names],
+        [tuple(sys.intern(value) for value in entries) for entries in values],
+        [array('q', costs) for costs in prices],
+        array('B', flags),
+    )
+
+
+def compile_catalog(data, source_hash=''):
+    """Validate parsed data.json content and compile it into a Catalog."""
+    if not isinstance(data, dict):
+        raise ValueError("catalog must be a JSON object")
+    attributes = data.get('attributes')
+    if not isinstance(attributes, list):
+        raise ValueError("catalog 'attributes' must be a list")
+
+    names = []
+    values = []
+    prices = []
+    flags = array('B')
+    for position, attribute in enumerate(attributes):
+        where = f"attribute {position}"
+        if not isinstance(attribute, dict):
+            raise ValueError(f"{where} must be an object")
+        name = attribute.get('name')
+        if not isinstance(name, str) or not name:
+            raise ValueError(f"{where} needs a non-empty 'name'")
+        where = f"attribute {name!r}"
+        attribute_values = attribute.get('values', [])
+        if not isinstance(attribute_values, list):
+            raise ValueError(f"{where} 'values' must be a list")
+
+        seen = set()
+        value_strings = []
+        value_prices = array('q')
+        for entry in attribute_values:
+            if not isinstance(entry, dict) or 'value' not in entry:
+                raise ValueError(f"{where} has a value without a 'value' field")
+            value = entry['value']
+            if isinstance(value, bool) or not isinstance(value, (str, int)) or str(value) == '':
+                raise ValueError(f"{where} has an invalid value {value!r}")
+            value = sys.intern(str(value))
+            if value in seen:
+                raise ValueError(f"{where} lists {value!r} more than once")
+            seen.add(value)
+            value_strings.append(value)
+            value_prices.append(parse_cents(entry.get('price', 0), f"{where} value {value!r}"))
+
+        names.append(sys.intern(name))
+        values.append(tuple(value_strings))
+        prices.append(value_prices)
+        flags.append((ENABLED if attribute.get('enabled', True) else 0) | (REQUIRED if attribute.get('required', False) else 0))
+
+    return Catalog(source_hash, compile_options(data), names, values, prices, flags)
+
+
+def compile_options(data):
+    """Map data.json options onto GenerateSku's option names and types."""
+    options = data.get('options', {})
+    if not isinstance(options, dict):
+        raise ValueError("catalog 'options' must be an object")
+
+    separator = options.get('separator', options.get('seperator', '-'))
+    if not isinstance(separator, str):
+        raise ValueError("option 'seperator' must be a string")
+
+    compiled = {
+        'prefixName': str(data.get('prefixValue', options.get('prefixName', 'Test'))),
+        'separator': separator,
+        'price': bool(options.get('price', True)),
+        'basePrice': parse_cents(options.get('basePrice', data.get('basePrice', 0)), "option 'basePrice'") / 100,
+        'vat': bool(options.get('vat', False)),
+        'vatType': adjustment_type(options.get('vatType', 'percentage'), 'vatType'),
+        'vatAmount': parse_amount(options.get('vatAmount', 0), 'vatAmount'),
+        'discount': bool(options.get('discount', False)),
+        'discountType': adjustment_type(options.get('discountType', 'percentage'), 'discountType'),
+        'discountAmount': parse_amount(options.get('discountAmount', 0), 'discountAmount'),
+        'uppercase': bool(options.get('uppercase', True)),
+    }
+    return compiled
+
+
+def adjustment_type(value, name):
+    if value not in ADJUSTMENT_TYPES:
+        raise ValueError(f"option {name!r} must be one of {sorted(ADJUSTMENT_TYPES)}, not {value!r}")
+    return ADJUSTMENT_TYPES[value]
+
+
+def parse_amount(value, name):
+    try:
+        amount = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f"option {name!r} must be a number, not {value!r}") from None
+    return int(amount) if amount == amount.to_integral_value() else float(amount)
+
+
+def parse_cents(value, where):
+    """Parse a price such as "1320", 0 or "12.50" into integer cents."""
+    if isinstance(value, bool):
+        raise ValueError(f"{where} has an invalid price {value!r}")
+    try:
+        amount = Decimal(str(value).strip() or '0')
+    except InvalidOperation:
+        raise ValueError(f"{where} has an invalid price {value!r}") from None
+    cents = amount * 100
+    if not cents.is_finite() or cents != cents.to_integral_value():
+        raise ValueError(f"{where} price {value!r} has more than two decimal places")
+    return int(cents)
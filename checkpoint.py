@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+
+
+class Checkpointer:
+    """Periodically record how far an output file has been written.
+
+    update(rows) is called after every block written to file. Every every_rows rows
+    it saves a checkpoint with the row count, the file size, the walk position
+    from position(rows) (subset number and mixed-radix value positions) and the
+    run key. The output is flushed and fsync'd before the checkpoint replaces the
+    previous one, so a checkpoint never points past data that isn't on disk.
+    """
+
+    def __init__(self, file, filename, every_rows=0, position=None, run=None):
+        self.file = file
+        self.filename = filename
+        self.every_rows = every_rows
+        self.position = position
+        self.run = run
+        self.next_rows = every_rows or float('inf')
+
+    def update(self, rows):
+        if rows >= self.next_rows:
+            self.save(rows)
+            self.next_rows = (rows // self.every_rows + 1) * self.every_rows
+
+    def save(self, rows, **extra):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        state = {'rows': rows, 'bytes': self.file.tell(), 'run': self.run}
+        if self.position is not None:
+            state.update(self.position(rows))
+        state.update(extra)
+        return save_checkpoint(self.filename, state)
+
+
+def checkpoint_filename(filename):
+    return f"{filename}.checkpoint"
+
+
+def run_key(*parts):
+    """Fingerprint what a run generates (sets, options, format), so --resume can refuse a different run."""
+    encoded = json.dumps(parts, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()[:32]
+
+
+def save_checkpoint(filename, state):
+    """Record how far the output file was written, replacing the previous checkpoint atomically.
+
+    state holds at least 'rows' (complete rows in the file) and 'bytes' (the file
+    size at that point).
+    """
+    path = checkpoint_filename(filename)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'w') as file:
+        json.dump({'output': filename, **state}, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+    try:
+        directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return path  # Directories can't be opened on every platform
+    try:
+        os.fsync(directory)
+    except OSError:
+        pass
+    finally:
+        os.close(directory)
+    return path
+
+
+def load_checkpoint(filename):
+    path = checkpoint_filename(filename)
+    try:
+        with open(path) as file:
+            checkpoint = json.load(file)
+    except FileNotFoundError:
+        raise ValueError(f"no checkpoint to resume from at {path}") from None
+    except json.JSONDecodeError:
+        raise ValueError(f"{path} is not a valid checkpoint") from None
+    if not isinstance(checkpoint, dict) or not all(isinstance(checkpoint.get(key), int) for key in ('rows', 'bytes')):
+        raise ValueError(f"{path} is not a valid checkpoint")
+    return checkpoint
+
+
+def resume_output(filename, run, position=None):
+    """Truncate filename back to its checkpoint and return the checkpoint.
+
+    Refuses a checkpoint written by a different run, one whose walk position
+    doesn't match position(rows) for this run, or an output file shorter than the
+    checkpoint says.
+    """
+    checkpoint = load_checkpoint(filename)
+    if checkpoint.get('run') != run:
+        raise ValueError(f"{checkpoint_filename(filename)} was written for a different catalog, options or format")
+    if position is not None:
+        expected = position(checkpoint['rows'])
+        if any(checkpoint.get(key) != value for key, value in expected.items()):
+            raise ValueError(f"{checkpoint_filename(filename)} doesn't match the walk position of row {checkpoint['rows']}")
+    size = os.path.getsize(filename)
+    if size < checkpoint['bytes']:
+        raise ValueError(f"{filename} is {size} bytes, shorter than its checkpoint ({checkpoint['bytes']} bytes)")
+    with open(filename, 'r+b') as file:
+        file.truncate(checkpoint['bytes'])
+    return checkpoint
+
+
+def remove_checkpoint(filename):
+    try:
+        os.remove(checkpoint_filename(filename))
+    except FileNotFoundError:
+        pass
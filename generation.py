@@ -0,0 +1,432 @@
+import math
+import os
+import sys
+import time
+from datetime import datetime
+from itertools import combinations, islice, product
+
+import psutil
+
+from budget import MemoryBudget
+
+
+def mixed_radix(number, sizes):
+    """Split number into digits with the given radixes, most significant first."""
+    digits = [0] * len(sizes)
+    for d in range(len(sizes) - 1, -1, -1):
+        number, digits[d] = divmod(number, sizes[d])
+    return digits
+
+
+def product_pieces(arrays, positions):
+    """Split itertools.product(*arrays) from the combination at the value positions on
+    into plain products, returned as lists of arrays in walk order.
+
+    The first piece is the remaining values of the last array under the fixed
+    prefix; then, carrying outwards, the remaining values at each depth with full
+    arrays below it.
+    """
+    depth = len(arrays)
+    fixed = [[values[position]] for values, position in zip(arrays, positions)]
+    pieces = [fixed[:depth - 1] + [arrays[depth - 1][positions[depth - 1]:]]]
+    for d in range(depth - 2, -1, -1):
+        pieces.append(fixed[:d] + [arrays[d][positions[d] + 1:]] + list(arrays[d + 1:]))
+    return pieces
+
+
+def product_from(arrays, positions):
+    """Yield itertools.product(*arrays) from the combination at the value positions on."""
+    for piece in product_pieces(arrays, positions):
+        yield from product(*piece)
+
+
+def build_layers(sets):
+    """Count the SKUs in every subset-size layer of sets.
+
+    suffix[j][k] is the number of SKUs made from k-subsets of sets[j:], i.e. the
+    elementary symmetric polynomial e_k over their sizes. It lets sku_at() and
+    index_of() skip whole groups of subsets instead of enumerating them.
+    """
+    sizes = [len(values) for values in sets]
+    n = len(sizes)
+    suffix = [[0] * (n + 1) for _ in range(n + 1)]
+    for j in range(n, -1, -1):
+        suffix[j][0] = 1
+        for k in range(1, n - j + 1):
+            suffix[j][k] = sizes[j] * suffix[j + 1][k - 1] + suffix[j + 1][k]
+
+    positions = []
+    for values in sets:
+        first_positions = {}
+        for position, value in enumerate(values):
+            first_positions.setdefault(value, position)
+        positions.append(first_positions)
+
+    return {
+        'sets': sets,
+        'sizes': sizes,
+        'suffix': suffix,
+        'counts': [suffix[0][k] for k in range(1, n + 1)],
+        'positions': positions,
+    }
+
+
+def layered_at(layers, index):
+    """Unrank index into the value tuple at that position of the layered walk."""
+    chosen, positions = layered_position(layers, index)
+    return [layers['sets'][j][position] for j, position in zip(chosen, positions)]
+
+
+def layered_position(layers, index):
+    """Unrank index into (chosen set indexes, value position in each chosen set)."""
+    sizes, suffix = layers['sizes'], layers['suffix']
+
+    # Find the subset size, then the subset, then the position in its product
+    subset_size = 1
+    for count in layers['counts']:
+        if index < count:
+            break
+        index -= count
+        subset_size += 1
+
+    chosen = []
+    prefix = 1
+    remaining = subset_size
+    j = 0
+    while remaining:
+        block = prefix * sizes[j] * suffix[j + 1][remaining - 1]
+        if index < block:
+            chosen.append(j)
+            prefix *= sizes[j]
+            remaining -= 1
+        else:
+            index -= block
+        j += 1
+
+    positions = [0] * subset_size
+    for slot in range(subset_size - 1, -1, -1):
+        index, positions[slot] = divmod(index, sizes[chosen[slot]])
+    return chosen, positions
+
+
+def layered_pieces(layers, start=0):
+    """Split the layered walk from position start on into plain products, as lists of arrays in walk order."""
+    sets = layers['sets']
+    n = len(sets)
+    if start >= sum(layers['counts']):
+        return
+    chosen, positions = layered_position(layers, start)
+    first = tuple(chosen)
+    for subset_size in range(len(chosen), n + 1):
+        for subset in combinations(range(n), subset_size):
+            if first is not None:
+                if subset != first:
+                    continue
+                first = None
+                yield from product_pieces([sets[j] for j in subset], positions)
+            else:
+                yield [sets[j] for j in subset]
+
+
+def layered_from(layers, start=0):
+    """Yield the value tuples of the layered walk from position start on."""
+    for piece in layered_pieces(layers, start):
+        yield from product(*piece)
+
+
+def walk_position(layers, index):
+    """Return the subset number and mixed-radix value positions of index in the layered walk, for checkpoints."""
+    n = len(layers['sizes'])
+    if index >= sum(layers['counts']):
+        return {'subset': 2 ** n - 1, 'position': []}
+    chosen, positions = layered_position(layers, index)
+    subset = tuple(chosen)
+    number = sum(math.comb(n, k) for k in range(1, len(subset)))
+    for candidate in combinations(range(n), len(subset)):
+        if candidate == subset:
+            break
+        number += 1
+    return {'subset': number, 'position': positions}
+
+
+def layered_index(layers, segments):
+    """Rank a value tuple within the layered walk, or None if it isn't in it."""
+    sizes, suffix, positions = layers['sizes'], layers['suffix'], layers['positions']
+    n = len(sizes)
+    subset_size = len(segments)
+    if not 1 <= subset_size <= n:
+        return None
+
+    # Assign segments to the earliest possible sets; that is the first occurrence
+    def match(segment, start):
+        if segment == subset_size:
+            return []
+        for j in range(start, n - (subset_size - segment) + 1):
+            position = positions[j].get(segments[segment])
+            if position is not None:
+                rest = match(segment + 1, j + 1)
+                if rest is not None:
+                    return [(j, position)] + rest
+        return None
+
+    matched = match(0, 0)
+    if matched is None:
+        return None
+
+    index = sum(layers['counts'][:subset_size - 1])
+    prefix = 1
+    remaining = subset_size
+    j = 0
+    for chosen, _ in matched:
+        while j < chosen:
+            index += prefix * sizes[j] * suffix[j + 1][remaining - 1]
+            j += 1
+        prefix *= sizes[j]
+        remaining -= 1
+        j += 1
+
+    product_index = 0
+    for chosen, position in matched:
+        product_index = product_index * sizes[chosen] + position
+    return index + product_index
+
+
+def layer_chars(sets):
+    """Count SKUs and value bytes per subset size in one O(attributes^2) pass.
+
+    counts[k] is the elementary symmetric polynomial e_k over the set sizes;
+    chars[k] is the total byte length of the values in all k-value SKUs.
+    """
+    n = len(sets)
+    counts = [1] + [0] * n
+    chars = [0] * (n + 1)
+    for values in sets:
+        size = len(values)
+        value_bytes = sum(len(value.encode()) for value in values)
+        for k in range(n, 0, -1):
+            chars[k] += size * chars[k - 1] + value_bytes * counts[k - 1]
+            counts[k] += size * counts[k - 1]
+    return counts, chars
+
+
+def measure_rate(skus, format_row=None, sample_rows=20000):
+    """Time up to sample_rows SKUs from an iterator (optionally formatted) in rows/sec."""
+    started = time.perf_counter()
+    rows = 0
+    for sku in islice(skus, sample_rows):
+        if format_row is not None:
+            format_row(sku)
+        rows += 1
+    elapsed = time.perf_counter() - started
+    return rows / elapsed if rows and elapsed > 0 else 0.0
+
+
+# Rows between progress samples when neither --progress-every nor --progress-seconds is given
+PROGRESS_EVERY = 100000
+
+
+class ProgressLog:
+    """Sample the time and memory usage every N rows and/or every T seconds.
+
+    Samples go to their own stream, so the SKU output only holds SKU data.
+    """
+
+    # Rows between clock reads when sampling on a time interval
+    CLOCK_CHECK_ROWS = 1024
+
+    def __init__(self, stream, every_rows=None, every_seconds=None):
+        self.stream = stream
+        self.every_rows = every_rows
+        self.every_seconds = every_seconds
+        self.process = psutil.Process(os.getpid())
+        self.rows = 0
+        self.row_mark = every_rows or float('inf')
+        self.time_mark = time.monotonic() + every_seconds if every_seconds else float('inf')
+        self.next_check = self.row_mark
+        if every_seconds:
+            self.next_check = min(self.next_check, self.CLOCK_CHECK_ROWS)
+
+    def update(self, rows=1):
+        self.rows += rows
+        if self.rows >= self.next_check:
+            self.check()
+
+    def check(self):
+        due = False
+        if self.rows >= self.row_mark:
+            due = True
+            self.row_mark = (self.rows // self.every_rows + 1) * self.every_rows
+        if self.every_seconds and time.monotonic() >= self.time_mark:
+            due = True
+        if due:
+            self.sample()
+
+        self.next_check = self.row_mark
+        if self.every_seconds:
+            self.next_check = min(self.next_check, self.rows + self.CLOCK_CHECK_ROWS)
+
+    def sample(self):
+        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        memory_usage = f"{self.process.memory_info().rss / 1024 ** 2:.2f} MB"
+        self.stream.write(f"{current_time} | {self.rows} rows | {memory_usage}\n")
+        self.stream.flush()
+        if self.every_seconds:
+            self.time_mark = time.monotonic() + self.every_seconds
+
+    def close(self):
+        """Write a final sample for the end of the run."""
+        self.sample()
+
+
+class BlockWriter:
+    """Write rows to a file, and optionally echo them to the console, in joined blocks.
+
+    rows_written counts the rows handed to the file. After every block a
+    Checkpointer, when given, is updated, and a MemoryBudget is checked, so a run
+    that goes over its limit stops between blocks with rows_written complete rows
+    on disk. With Instruments, joining and writing each block is timed as the
+    write stage.
+    """
+
+    def __init__(self, file, echo=True, batch_rows=4096, budget=None, checkpoint=None, instruments=None):
+        self.file = file
+        self.echo = echo
+        self.batch_rows = batch_rows
+        self.budget = budget
+        self.checkpoint = checkpoint
+        self.instruments = instruments
+        self.rows = []
+        self.rows_written = 0
+
+    def write(self, row):
+        """Queue one row (without its trailing newline)."""
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_rows:
+            self.flush()
+
+    def write_block(self, block):
+        """Write an already joined block of newline-terminated rows."""
+        self.flush()
+        started = time.perf_counter_ns() if self.instruments is not None else 0
+        self.emit(block, block.count('\n'), started)
+
+    def flush(self):
+        if not self.rows:
+            return
+        started = time.perf_counter_ns() if self.instruments is not None else 0
+        block = '\n'.join(self.rows) + '\n'
+        rows = len(self.rows)
+        self.rows.clear()
+        self.emit(block, rows, started)
+
+    def emit(self, block, rows, started):
+        self.file.write(block)
+        if self.echo:
+            sys.stdout.write(block)
+        self.rows_written += rows
+        if self.checkpoint is not None:
+            self.checkpoint.update(self.rows_written)
+        if self.budget is not None:
+            self.budget.check(self.relieve)
+        if self.instruments is not None:
+            self.instruments.add('write', time.perf_counter_ns() - started, rows)
+
+    def relieve(self):
+        """Backpressure: push buffered output to the OS and halve the batch size."""
+        self.file.flush()
+        if self.batch_rows <= MemoryBudget.MIN_BATCH_ROWS:
+            return False
+        self.batch_rows = max(MemoryBudget.MIN_BATCH_ROWS, self.batch_rows // 2)
+        return True
+
+
+def add_output_arguments(parser, memory_limit=None):
+    """Add --quiet, --batch-rows and --buffer-size, plus --memory-limit when it has a default."""
+    parser.add_argument('--quiet', action='store_true', help="don't echo every row to stdout")
+    if memory_limit is None:
+        parser.add_argument('--batch-rows', type=int, default=4096, metavar='N',
+                            help="rows joined into one write (default: 4096)")
+        parser.add_argument('--buffer-size', type=int, default=1024 * 1024, metavar='BYTES',
+                            help="output file buffer size (default: 1048576)")
+        return
+    parser.add_argument('--batch-rows', type=int, metavar='N',
+                        help="rows joined into one write (default: 4096, less under a tight --memory-limit)")
+    parser.add_argument('--buffer-size', type=int, metavar='BYTES',
+                        help="output file buffer size (default: 1048576, less under a tight --memory-limit)")
+    parser.add_argument('--memory-limit', type=float, default=memory_limit, metavar='MB',
+                        help="RSS budget; buffers and batches are sized to fit and the run stops cleanly "
+                             f"with a checkpoint if it can't stay under it (default: {memory_limit:g}, 0 for none)")
+
+
+def add_checkpoint_arguments(parser):
+    parser.add_argument('--checkpoint-every', type=int, default=1000000, metavar='ROWS',
+                        help="save a resumable checkpoint every ROWS rows (default: 1000000, 0 for none)")
+    parser.add_argument('--resume', action='store_true',
+                        help="truncate the output to its last checkpoint and continue the run from there")
+
+
+def add_estimate_arguments(parser):
+    parser.add_argument('--estimate', action='store_true',
+                        help="print the exact row count and projected size and runtime, then exit")
+    parser.add_argument('--max-rows', type=int, metavar='N', help="refuse to start if the run would write more rows")
+    parser.add_argument('--max-bytes', type=int, metavar='N', help="refuse to start if the output would be larger")
+
+
+def check_estimate(args, estimate):
+    """Print the estimate when asked; return False when the run should not start."""
+    summary = (f"{estimate['rows']} rows, {estimate['bytes'] / 1024 ** 2:.1f} MB, "
+               f"~{estimate['seconds']:.0f}s at {estimate['rowsPerSecond']:.0f} rows/sec")
+    if args.estimate:
+        print(f"Estimate: {summary}")
+        return False
+    if args.max_rows is not None and estimate['rows'] > args.max_rows:
+        print(f"Refusing to start: {summary} exceeds --max-rows {args.max_rows}")
+        return False
+    if args.max_bytes is not None and estimate['bytes'] > args.max_bytes:
+        print(f"Refusing to start: {summary} exceeds --max-bytes {args.max_bytes}")
+        return False
+    return True
+
+
+def add_progress_arguments(parser):
+    parser.add_argument('--progress-every', type=int, metavar='N',
+                        help=f"log time and memory every N rows (default: {PROGRESS_EVERY} unless only "
+                             "--progress-seconds is given); 0 writes them on every SKU row instead")
+    parser.add_argument('--progress-seconds', type=float, metavar='T',
+                        help="log time and memory every T seconds")
+    parser.add_argument('--progress-file', metavar='PATH',
+                        help="write sampled progress to PATH (default: stderr)")
+
+
+def sampled_progress(args):
+    """Return whether progress is sampled rather than written on every SKU row.
+
+    Sampling every PROGRESS_EVERY rows is the default, as reading the clock and
+    the memory usage for every row costs more than building the SKU;
+    --progress-every 0 without --progress-seconds brings the per-row columns back.
+    """
+    if args.progress_every is None and not args.progress_seconds:
+        args.progress_every = PROGRESS_EVERY
+    return bool(args.progress_every or args.progress_seconds)
+
+
+def open_progress(args):
+    """Return a ProgressLog when progress is sampled, else None."""
+    if not sampled_progress(args):
+        return None
+    stream = open(args.progress_file, 'w') if args.progress_file else sys.stderr
+    return ProgressLog(stream, args.progress_every, args.progress_seconds)
+
+
+def close_progress(progress):
+    if progress is None:
+        return
+    progress.close()
+    if progress.stream is not sys.stderr:
+        progress.stream.close()
+
+
+def stop_for_budget(error, checkpointer, rows_written):
+    """End a run that went over its memory budget, leaving a checkpoint for the rows on disk."""
+    path = checkpointer.save(rows_written, reason=str(error))
+    print(f"Stopped: {error}. {rows_written} rows written; checkpoint saved to {path}", file=sys.stderr)
@@ -1,9 +1,241 @@
+import argparse
+import bisect
+import collections
 import itertools
-import datetime
+import functools
+import heapq
+import json
+import math
 import os
+import struct
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+from catalog import Catalog, load_catalog, parse_cents
+from checkpoint import Checkpointer, remove_checkpoint, resume_output, run_key
+from generation import BlockWriter, add_checkpoint_arguments, add_output_arguments, mixed_radix
+
+# '.00' .. '.99', so format_cents never goes through float
+CENT_SUFFIXES = ['.%02d' % cents for cents in range(100)]
+
+# One SKU and its price breakdown, as a single tuple instead of a list plus a dict
+PriceRecord = collections.namedtuple('PriceRecord', ['sku', 'subtotal', 'discount', 'vat', 'totalPrice'])
+
+
+class AttributeValues(list):
+    """The values of one attribute, as prepare_sets builds them.
+
+    attribute is the attribute's position in GenerateSku.attributes, so its
+    price table is found by position rather than by comparing value lists.
+    """
+
+    def __init__(self, values=(), attribute=None):
+        super().__init__(values)
+        self.attribute = attribute
+
+
+class RecordBlock:
+    """A block of SKUs from generate_record_blocks with array-backed price columns.
+
+    subtotal and totalPrice are arrays; discount and vat are arrays too, or the
+    single value every row shares when the adjustment is disabled or fixed.
+    """
+
+    __slots__ = ('skus', 'subtotal', 'discount', 'vat', 'totalPrice')
+
+    def __init__(self, skus, subtotal, discount, vat, total_price):
+        self.skus = skus
+        self.subtotal = subtotal
+        self.discount = discount
+        self.vat = vat
+        self.totalPrice = total_price
+
+    def __len__(self):
+        return len(self.skus)
+
+    def __iter__(self):
+        return map(PriceRecord, self.skus, self.subtotal, self.column('discount'), self.column('vat'), self.totalPrice)
+
+    def column(self, name):
+        """Return a column as a sequence, repeating a shared value for every row."""
+        values = getattr(self, name)
+        return values if isinstance(values, array) else itertools.repeat(values, len(self.skus))
+
+
+class Options(dict):
+    """Option dict that counts its changes, so caches built from it can tell they're stale."""
+
+    version = 0
+
+    def changed(self):
+        self.version += 1
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.changed()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.changed()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.changed()
+        return super().setdefault(key, default)
+
+    def pop(self, *args):
+        self.changed()
+        return super().pop(*args)
+
+    def popitem(self):
+        self.changed()
+        return super().popitem()
+
+    def clear(self):
+        super().clear()
+        self.changed()
+
+
+class Instruments:
+    """Per-stage counters and cumulative perf_counter_ns timers for one price.py run.
+
+    Stages are enumerate (walking the product and building SKU strings), filter
+    (the pruned walk of generate_filtered), price (discount and VAT into the price
+    columns), format (rows to text) and write (joining and file I/O). Code that
+    times a stage calls add() once per block (once per row on the row-at-a-time
+    filtered path), so the cost is a few clock reads per block; with
+    GenerateSku.instruments left as None nothing is timed at all.
+    With profile='cprofile' or 'tracemalloc' the run is also profiled or its
+    allocations traced, and summary() includes the top entries.
+    """
+
+    STAGES = ('enumerate', 'filter', 'price', 'format', 'write')
+
+    # Entries kept from the profile or the allocation snapshot
+    TOP_ENTRIES = 20
+
+    def __init__(self, profile=None):
+        self.profile = profile
+        self.ns = dict.fromkeys(self.STAGES, 0)
+        self.calls = dict.fromkeys(self.STAGES, 0)
+        self.rows = dict.fromkeys(self.STAGES, 0)
+        self.profiler = None
+        self.started = None
+        self.stopped = None
+
+    def add(self, stage, ns, rows=0):
+        self.ns[stage] += ns
+        self.calls[stage] += 1
+        self.rows[stage] += rows
+
+    def timed(self, iterable, stage):
+        """Yield from iterable, adding the time spent producing each item to stage."""
+        clock = time.perf_counter_ns
+        items = iter(iterable)
+        while True:
+            started = clock()
+            try:
+                item = next(items)
+            except StopIteration:
+                self.add(stage, clock() - started)
+                return
+            self.add(stage, clock() - started, 1)
+            yield item
+
+    def start(self):
+        if self.profile == 'cprofile':
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif self.profile == 'tracemalloc':
+            import tracemalloc
+            tracemalloc.start()
+        self.started = time.perf_counter_ns()
+
+    def stop(self):
+        self.stopped = time.perf_counter_ns()
+        if self.profiler is not None:
+            self.profiler.disable()
+
+    def summary(self, rows, output_bytes):
+        """Return the run's timings as a JSON-ready dict."""
+        wall = ((self.stopped or time.perf_counter_ns()) - self.started) / 1e9
+        stages = {}
+        for stage in self.STAGES:
+            if not self.calls[stage]:
+                continue
+            seconds = self.ns[stage] / 1e9
+            stages[stage] = {
+                'seconds': round(seconds, 6),
+                'calls': self.calls[stage],
+                'rows': self.rows[stage],
+                'share': round(seconds / wall, 4) if wall else 0.0,
+                'rowsPerSecond': round(self.rows[stage] / seconds) if seconds else None,
+            }
+        summary = {
+            'wallSeconds': round(wall, 6),
+            'rows': rows,
+            'bytes': output_bytes,
+            'rowsPerSecond': round(rows / wall) if wall else None,
+            'bytesPerSecond': round(output_bytes / wall) if wall else None,
+            'stages': stages,
+            'unaccountedSeconds': round(wall - sum(self.ns.values()) / 1e9, 6),
+        }
+        if self.profiler is not None:
+            summary['profile'] = self.profile_entries()
+        elif self.profile == 'tracemalloc':
+            summary['memory'] = self.memory_entries()
+        return summary
+
+    def profile_entries(self):
+        """The functions with the most own time, from the cProfile run."""
+        import pstats
+        stats = pstats.Stats(self.profiler).stats
+        entries = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:self.TOP_ENTRIES]
+        return [
+            {
+                'function': f"{filename}:{line}({name})",
+                'calls': calls,
+                'ownSeconds': round(own, 6),
+                'cumulativeSeconds': round(cumulative, 6),
+            }
+            for (filename, line, name), (_, calls, own, cumulative, _) in entries
+        ]
+
+    def memory_entries(self):
+        """Peak traced memory and the lines holding the most of it now."""
+        import tracemalloc
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        return {
+            'currentBytes': current,
+            'peakBytes': peak,
+            'top': [
+                {'where': str(stat.traceback[0]), 'bytes': stat.size, 'count': stat.count}
+                for stat in snapshot.statistics('lineno')[:self.TOP_ENTRIES]
+            ],
+        }
+
 
 class GenerateSku:
-    def __init__(self, attributes):
+    # Value index stored for sets that are not part of a SKU in the binary output
+    ABSENT_INDEX = 255
+    # Relative slack top_k leaves for float totals that differ only in rounding
+    TOP_K_SLACK = 1e-9
+
+    def __init__(self, attributes, quote_cache_size=4096):
+        self.quote_cache_size = quote_cache_size
         self.attributes = attributes
         self.options = {
             'prefixName': 'Test',
@@ -17,48 +249,999 @@ class GenerateSku:
             'discountType': 'percentage',
             'discountAmount': 10,
             'uppercase': True,
+            # 'float' keeps the original float maths; 'cents' prices in integer cents
+            'priceMode': 'float',
         }
+        # Instruments collecting stage timings, or None for no instrumentation
+        self.instruments = None
+        # Filled in by build_index; until then len() is 0
+        self.index_sets = []
+        self.index_subsets = []
+        self.index_offsets = [0]
+
+    @property
+    def attributes(self):
+        return self._attributes
+
+    @attributes.setter
+    def attributes(self, attributes):
+        # A compiled Catalog prices from its cents arrays until the attributes are edited
+        self.catalog = attributes if isinstance(attributes, Catalog) else None
+        self._attributes = attributes.attributes() if self.catalog is not None else attributes
+        self.attributes_version = 0
+        self.compile_attributes()
+
+    def compile_attributes(self):
+        """Build the price tables from the catalog or the attribute data and drop cached quotes."""
+        if self.catalog is not None:
+            self.cent_tables = self.catalog.cent_tables()
+            self.price_tables = [{value: cents / 100 for value, cents in table.items()} for table in self.cent_tables]
+        else:
+            self.price_tables = self.build_price_tables()
+            self.cent_tables = self.build_cent_tables()
+        self.value_prices = self.build_value_prices()
+        self.value_cents = self.build_value_prices(self.cent_tables)
+        self.quote_attributes = self.build_quote_attributes()
+        self.compiled_version = self.attributes_version
+        self.invalidate_quotes()
+
+    def invalidate(self):
+        """Mark the attribute data as edited in place, so the price tables are rebuilt on next use."""
+        self.attributes_version += 1
+
+    def refresh_attributes(self):
+        """Recompile the price tables if invalidate() was called since they were built."""
+        if self.attributes_version != self.compiled_version:
+            self.catalog = None
+            self.compile_attributes()
+
+    @property
+    def options(self):
+        return self._options
+
+    @options.setter
+    def options(self, options):
+        self._options = Options(options)
+        self.cent_rates_version = None
+        self.invalidate_quotes()
+
+    def quote(self, selection):
+        """Price one configuration given as {attribute name: value}.
+
+        Returns the subtotal/discount/vat/totalPrice breakdown that price.py writes
+        for the same SKU, as a new dict on every call. Results are kept in an LRU
+        cache of quote_cache_size entries, keyed by the selected items whatever
+        their order. The cache is dropped whenever the options change or the
+        attributes are reassigned or invalidate()d; quote_info() reports its hits
+        and misses.
+        """
+        if self.attributes_version != self.compiled_version:
+            self.refresh_attributes()
+        if self._options.version != self.quote_version:
+            self.invalidate_quotes()
+        return dict(self.cached_quote(frozenset(selection.items())))
+
+    def quote_info(self):
+        """Return the quote cache's hits, misses, size and maximum size since it was last dropped."""
+        info = self.cached_quote.cache_info()
+        return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize, 'maxSize': info.maxsize}
+
+    def invalidate_quotes(self):
+        self.quote_version = self._options.version if hasattr(self, '_options') else 0
+        self.cached_quote = functools.lru_cache(maxsize=self.quote_cache_size)(self.price_selection)
+
+    def build_quote_attributes(self):
+        """Map each enabled attribute name to its position for quote()."""
+        quote_attributes = {}
+        for position, attribute in enumerate(self._attributes):
+            if attribute['enabled'] and attribute['values']:
+                quote_attributes[attribute['name']] = position
+        return quote_attributes
+
+    def price_selection(self, selection):
+        """Validate a set of (attribute name, value) pairs and price it."""
+        price_tables = self.cent_tables if self.options['priceMode'] == 'cents' else self.price_tables
+        picked = []
+        for name, value in selection:
+            if name not in self.quote_attributes:
+                raise ValueError(f"unknown or disabled attribute {name!r}")
+            position = self.quote_attributes[name]
+            table = price_tables[position]
+            if value not in table:
+                raise ValueError(f"{value!r} is not a value of {name!r}")
+            picked.append((position, value, table))
+        if not picked:
+            raise ValueError("select at least one attribute")
+        chosen = {name for name, _ in selection}
+        for name, position in self.quote_attributes.items():
+            if self._attributes[position]['required'] and name not in chosen:
+                raise ValueError(f"required attribute {name!r} is missing")
+
+        # Add prices in attribute order, as generate_combinations does
+        picked.sort(key=lambda entry: entry[0])
+        return self.calculate_price([value for _, value, _ in picked], [table for _, _, table in picked])
 
     def generate_combinations(self, sets, required_sets):
         if not sets:
             yield self.options['prefixName']
             return
 
-        # Handle combinations
-        for subset_size in range(1, len(sets) + 1):
-            for subset in self.get_subsets(sets, subset_size):
-                for combination in self.cartesian_product(subset):
-                    # Ensure required attributes are included in every combination
-                    if self.contains_required_attributes(combination, required_sets):
-                        # Calculate price of the combination
-                        price = self.calculate_price(combination)
-                        yield [
-                            self.options['prefixName'] + self.options['separator'] + self.options['separator'].join(combination),
-                            price
-                        ]
-
-    def contains_required_attributes(self, combination, required_sets):
+        # Resolve each set to its attribute's price table once, not per SKU
+        tables, base, adjust = self.row_pricing(sets)
+
+        # Handle combinations; every subset already includes the required attributes
+        for indexes in self.valid_subsets(sets, required_sets):
+            subset = [sets[i] for i in indexes]
+            subset_tables = [tables[i] for i in indexes]
+            yield from self.generate_subset(subset, subset_tables, base, adjust)
+
+    def generate_subset(self, subset, subset_tables, base=None, adjust=None):
+        adjust = adjust or self.apply_adjustments
+        for combination, subtotal in self.priced_product(subset, subset_tables, base=base):
+            # Apply discount and VAT to the running subtotal
+            price = adjust(subtotal)
+            yield [
+                self.options['prefixName'] + self.options['separator'] + self.options['separator'].join(combination),
+                price
+            ]
+
+    def generate_records(self, sets, required_sets):
+        """Like generate_combinations, but yield one PriceRecord per SKU instead of [sku, dict]."""
+        for block in self.generate_record_blocks(sets, required_sets):
+            yield from block
+
+    def generate_record_blocks(self, sets, required_sets, block_rows=4096, start=0):
+        """Like generate_combinations, but yield RecordBlocks of up to block_rows SKUs.
+
+        The prices go straight into array('d') columns (array('q') cents in 'cents'
+        mode), so a block holds one str per SKU and no per-row lists, dicts or floats.
+        With start, the walk begins at that row without generating the rows before it.
+        """
+        if not sets:
+            return
+        subsets = self.valid_subsets(sets, required_sets)
+        positions = None
+        if start:
+            located = self.locate_row(sets, required_sets, start)
+            if located is None:
+                return
+            subset_number, positions = located
+            subsets = itertools.islice(subsets, subset_number, None)
+        tables, base, adjust = self.row_pricing(sets)
+        cents = self.options['priceMode'] == 'cents'
+        # Blocks only copy the prices into their columns, so rows with equal subtotals can
+        # share one breakdown; typed, so the cache never hands back 0 for 0.0
+        adjust = functools.lru_cache(maxsize=65536, typed=True)(adjust)
+        typecode = 'q' if cents else 'd'
+        shared_discount = self.shared_adjustment('discount')
+        shared_vat = self.shared_adjustment('vat')
+
+        separator = self.options['separator']
+        prefix = self.options['prefixName'] + separator
+        join = separator.join
+
+        def new_block():
+            return RecordBlock(
+                [], array(typecode),
+                array(typecode) if shared_discount is None else shared_discount,
+                array(typecode) if shared_vat is None else shared_vat,
+                array(typecode),
+            )
+
+        instruments = self.instruments
+        if instruments is not None:
+            clock = time.perf_counter_ns
+
+        block = new_block()
+        skus = block.skus
+        for indexes in subsets:
+            subset = [sets[i] for i in indexes]
+            subset_tables = [tables[i] for i in indexes]
+            rows = self.priced_product(subset, subset_tables, positions, base=base)
+            positions = None
+            if instruments is not None:
+                # Same rows, filled in two timed passes per chunk: walk + SKU strings, then prices
+                while True:
+                    started = clock()
+                    chunk = list(itertools.islice(rows, block_rows - len(skus)))
+                    if not chunk:
+                        break
+                    skus.extend([prefix + join(combination) for combination, _ in chunk])
+                    enumerated = clock()
+                    for _, subtotal in chunk:
+                        price = adjust(subtotal)
+                        block.subtotal.append(price['subtotal'])
+                        if shared_discount is None:
+                            block.discount.append(price['discount'])
+                        if shared_vat is None:
+                            block.vat.append(price['vat'])
+                        block.totalPrice.append(price['totalPrice'])
+                    instruments.add('enumerate', enumerated - started, len(chunk))
+                    instruments.add('price', clock() - enumerated, len(chunk))
+                    if len(skus) >= block_rows:
+                        yield block
+                        block = new_block()
+                        skus = block.skus
+                continue
+            for combination, subtotal in rows:
+                price = adjust(subtotal)
+                skus.append(prefix + join(combination))
+                block.subtotal.append(price['subtotal'])
+                if shared_discount is None:
+                    block.discount.append(price['discount'])
+                if shared_vat is None:
+                    block.vat.append(price['vat'])
+                block.totalPrice.append(price['totalPrice'])
+                if len(skus) >= block_rows:
+                    yield block
+                    block = new_block()
+                    skus = block.skus
+        if skus:
+            yield block
+
+    def locate_row(self, sets, required_sets, row):
+        """Return (subset number, value positions) of a row of generate_combinations,
+        or None when the walk has fewer rows."""
+        for subset_number, indexes in enumerate(self.valid_subsets(sets, required_sets)):
+            sizes = [len(sets[i]) for i in indexes]
+            rows = math.prod(sizes)
+            if row < rows:
+                return subset_number, mixed_radix(row, sizes)
+            row -= rows
+        return None
+
+    def walk_position(self, sets, required_sets, row):
+        """Describe where row is in the walk, for checkpoints."""
+        located = self.locate_row(sets, required_sets, row)
+        if located is None:
+            return {'subset': None, 'position': []}
+        return {'subset': located[0], 'position': located[1]}
+
+    def shared_adjustment(self, name):
+        """Return the discount or vat every row gets, or None when it depends on the subtotal."""
+        if not self.options[name]:
+            return 0
+        if self.options[f"{name}Type"] == 'percentage':
+            return None
+        if self.options['priceMode'] == 'cents':
+            return parse_cents(self.options[f"{name}Amount"], f"option '{name}Amount'")
+        return self.options[f"{name}Amount"]
+
+    def required_indexes(self, sets, required_sets):
+        """Return the indexes in sets of the required sets, or None if one is missing.
+
+        Sets are matched by identity, as prepare_sets builds them, falling back to
+        equal value lists for copies.
+        """
+        indexes = set()
         for required_set in required_sets:
-            if not any(item in required_set for item in combination):
-                return False
-        return True
+            for i, values in enumerate(sets):
+                if values is required_set:
+                    indexes.add(i)
+                    break
+            else:
+                for i, values in enumerate(sets):
+                    if list(values) == list(required_set):
+                        indexes.add(i)
+                        break
+                else:
+                    return None
+        return sorted(indexes)
+
+    def valid_subsets(self, sets, required_sets):
+        """Yield the subsets of set indexes that include every required set.
+
+        Only the optional sets are chosen freely, so subsets missing a required
+        attribute are never built. The order matches walking every subset by size
+        and skipping the invalid ones.
+        """
+        required = self.required_indexes(sets, required_sets)
+        if required is None:
+            return
+        optional = [i for i in range(len(sets)) if i not in required]
+        for subset_size in range(max(len(required), 1), len(sets) + 1):
+            for chosen in itertools.combinations(optional, subset_size - len(required)):
+                yield tuple(sorted(required + list(chosen)))
+
+    def generate_filtered(self, sets, required_sets, low=None, high=None, excluded_pairs=()):
+        """Generate the rows of generate_combinations whose totalPrice is in [low, high]
+        and that don't hold both values of any excluded pair.
+
+        Each subset is walked depth first. A branch is cut as soon as its subtotal
+        plus the cheapest (or dearest) remaining values can't reach the range, or as
+        soon as a value excluded with one already fixed is picked, so selective
+        filters only visit the branches that lead to matching rows.
+        """
+        if not sets:
+            return
+        partners = {}
+        for first, second in excluded_pairs:
+            partners.setdefault(first, set()).add(second)
+            partners.setdefault(second, set()).add(first)
+
+        tables, base, adjust = self.row_pricing(sets)
+        for indexes in self.valid_subsets(sets, required_sets):
+            subset = [sets[i] for i in indexes]
+            subset_tables = [tables[i] for i in indexes]
+            yield from self.filtered_product(subset, subset_tables, low, high, partners, base, adjust)
+
+    def filtered_product(self, arrays, tables, low, high, partners, base=None, adjust=None):
+        """Depth-first walk of a product in itertools.product order, with pruning."""
+        adjust = adjust or self.apply_adjustments
+        base = float(self.options['basePrice']) if base is None else base
+        # Tables hold cents in 'cents' mode, while low and high are always in currency units
+        scale = 100 if self.options['priceMode'] == 'cents' else 1
+        low = float('-inf') if low is None else low
+        high = float('inf') if high is None else high
+        depth = len(arrays)
+        if any(not values for values in arrays):
+            return
+
+        prices = [[table.get(value, 0.0) for value in values] for values, table in zip(arrays, tables)]
+        sizes = [len(values) for values in arrays]
+        # rest_min[d] / rest_max[d]: cheapest and dearest prices of positions d onwards
+        rest_min = [0.0] * (depth + 1)
+        rest_max = [0.0] * (depth + 1)
+        for d in range(depth - 1, -1, -1):
+            rest_min[d] = rest_min[d + 1] + min(prices[d])
+            rest_max[d] = rest_max[d + 1] + max(prices[d])
+
+        # totalPrice = slope * subtotal + intercept, so bounds on the subtotal bound the total
+        intercept = self.apply_adjustments(0.0)['totalPrice']
+        slope = (self.apply_adjustments(1.0)['totalPrice'] - intercept) / scale
+        bounded = low != float('-inf') or high != float('inf')
+        # Rounding discount and VAT to whole cents moves a total by at most this much
+        rounding = 0
+        if scale > 1:
+            vat_rate = abs(self.options['vatAmount']) / 100 if self.options['vatType'] == 'percentage' else 0
+            rounding = (1 + vat_rate) / scale
+
+        separator = self.options['separator']
+        prefix = self.options['prefixName'] + separator
+        last = depth - 1
+        positions = [-1] * depth
+        combination = [None] * depth
+        subtotals = [base] * (depth + 1)
+        d = 0
+        while d >= 0:
+            positions[d] += 1
+            if positions[d] >= sizes[d]:
+                positions[d] = -1
+                d -= 1
+                continue
+
+            value = arrays[d][positions[d]]
+            if partners and value in partners and not partners[value].isdisjoint(combination[:d]):
+                continue
+            subtotal = subtotals[d] + prices[d][positions[d]]
+
+            if d == last:
+                price = adjust(subtotal)
+                if low <= price['totalPrice'] / scale <= high:
+                    combination[d] = value
+                    yield [prefix + separator.join(combination), price]
+                continue
+
+            if bounded:
+                cheapest = slope * (subtotal + rest_min[d + 1]) + intercept
+                dearest = slope * (subtotal + rest_max[d + 1]) + intercept
+                if slope < 0:
+                    cheapest, dearest = dearest, cheapest
+                # Leave room for float and whole-cent rounding; the leaves check the exact total
+                margin = 1e-9 * (abs(cheapest) + abs(dearest) + 1) + rounding
+                if cheapest > high + margin or dearest < low - margin:
+                    continue
+
+            combination[d] = value
+            subtotals[d + 1] = subtotal
+            d += 1
+
+    def touching_product(self, sets, required_sets, touched):
+        """Yield (subset indexes, combination, subtotal) for every SKU holding a touched value.
+
+        touched[i] is the set of values of sets[i] to look for. Within each subset
+        the SKUs are split by the first position holding a touched value: earlier
+        positions walk only untouched values, that position only touched ones and
+        later positions everything, so each SKU comes up once and untouched
+        sub-lattices are never walked.
+        """
+        tables, base, _ = self.row_pricing(sets)
+        for indexes in self.valid_subsets(sets, required_sets):
+            subset_tables = [tables[i] for i in indexes]
+            for first, i in enumerate(indexes):
+                if not touched[i]:
+                    continue
+                arrays = [[value for value in sets[j] if value not in touched[j]] for j in indexes[:first]]
+                arrays.append([value for value in sets[i] if value in touched[i]])
+                arrays.extend(sets[j] for j in indexes[first + 1:])
+                for combination, subtotal in self.priced_product(arrays, subset_tables, base=base):
+                    yield indexes, combination, subtotal
+
+    def plan_shards(self, sets, workers, required_sets=()):
+        """Split the walk into at most `workers` contiguous task ranges, in serial order.
+
+        A task is (subset indexes, position of the subset's first value), so running a
+        range of tasks with generate_tasks yields a contiguous slice of
+        generate_combinations. Ranges are balanced by the number of tuples walked.
+        """
+        tasks = []
+        for indexes in self.valid_subsets(sets, required_sets):
+            rest = 1
+            for i in indexes[1:]:
+                rest *= len(sets[i])
+            for position in range(len(sets[indexes[0]])):
+                tasks.append(((indexes, position), rest))
+
+        total = sum(weight for _, weight in tasks)
+        shards = []
+        current = []
+        done = 0
+        for task, weight in tasks:
+            current.append(task)
+            done += weight
+            if done * workers >= total * (len(shards) + 1) and len(shards) < workers - 1:
+                shards.append(current)
+                current = []
+        if current:
+            shards.append(current)
+        return shards
+
+    def generate_tasks(self, sets, tasks):
+        """Generate the rows for a range of tasks from plan_shards."""
+        tables, base, adjust = self.row_pricing(sets)
+        for indexes, position in tasks:
+            subset = [sets[indexes[0]][position:position + 1]] + [sets[i] for i in indexes[1:]]
+            subset_tables = [tables[i] for i in indexes]
+            yield from self.generate_subset(subset, subset_tables, base, adjust)
+
+    def priced_product(self, arrays, tables, start=None, base=None):
+        """Walk the cartesian product like an odometer, carrying subtotals per depth.
+
+        subtotals[d] holds the base price plus the prices of the first d values, so
+        moving to the next combination only re-adds the positions that changed.
+        Yields (combination, subtotal) in the same order as itertools.product,
+        beginning at the value positions in start when given.
+        """
+        base = float(self.options['basePrice']) if base is None else base
+        depth = len(arrays)
+        if depth == 0:
+            yield (), base
+            return
+        if any(not values for values in arrays):
+            return
+
+        prices = [[table.get(value, 0.0) for value in values] for values, table in zip(arrays, tables)]
+        sizes = [len(values) for values in arrays]
+        positions = list(start) if start else [0] * depth
+        combination = [values[position] for values, position in zip(arrays, positions)]
+        subtotals = [base] * (depth + 1)
+        for d in range(depth):
+            subtotals[d + 1] = subtotals[d] + prices[d][positions[d]]
+
+        last = depth - 1
+        last_pairs = list(zip(arrays[last], prices[last]))
+        first = positions[last]
+        while True:
+            # Innermost attribute: only the last value and price change
+            head = subtotals[last]
+            for value, price in (last_pairs[first:] if first else last_pairs):
+                combination[last] = value
+                yield tuple(combination), head + price
+            first = 0
+
+            # Advance the odometer, carrying into the outer positions
+            d = last - 1
+            while d >= 0:
+                positions[d] += 1
+                if positions[d] < sizes[d]:
+                    break
+                positions[d] = 0
+                d -= 1
+            if d < 0:
+                return
+
+            # Re-add only the positions from the carry point inwards
+            for k in range(d, last):
+                value_index = positions[k]
+                combination[k] = arrays[k][value_index]
+                subtotals[k + 1] = subtotals[k] + prices[k][value_index]
+
+    def build_index(self, sets, required_sets):
+        """Precompute the subset offsets behind len(), sku_at() and generate_range()."""
+        self.index_sets = sets
+        self.index_subsets = list(self.valid_subsets(sets, required_sets)) if sets else []
+        # index_offsets[n] is the row where subset n starts; the last entry is the total
+        self.index_offsets = [0]
+        for indexes in self.index_subsets:
+            rows = 1
+            for i in indexes:
+                rows *= len(sets[i])
+            self.index_offsets.append(self.index_offsets[-1] + rows)
+        return self
+
+    def __len__(self):
+        return self.index_offsets[-1]
+
+    def sku_at(self, index):
+        """Return the row generate_combinations(sets, required_sets) yields at index."""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("SKU index out of range")
+        return next(self.generate_range(index, index + 1))
+
+    def generate_range(self, start, stop):
+        """Generate rows [start, stop) of generate_combinations without walking the rows before them."""
+        start = max(start, 0)
+        stop = min(stop, len(self))
+        # Priced with the current options, which may have changed since build_index
+        tables, base, adjust = self.row_pricing(self.index_sets)
+        subset_number = bisect.bisect_right(self.index_offsets, start) - 1
+        while start < stop:
+            indexes = self.index_subsets[subset_number]
+            subset = [self.index_sets[i] for i in indexes]
+            subset_tables = [tables[i] for i in indexes]
+            subset_stop = min(stop, self.index_offsets[subset_number + 1])
+
+            # Decode the row number within the subset into value positions
+            positions = mixed_radix(start - self.index_offsets[subset_number], [len(values) for values in subset])
+
+            rows = itertools.islice(
+                self.priced_product(subset, subset_tables, positions, base), subset_stop - start
+            )
+            for combination, subtotal in rows:
+                yield [
+                    self.options['prefixName'] + self.options['separator'] + self.options['separator'].join(combination),
+                    adjust(subtotal)
+                ]
+            start = subset_stop
+            subset_number += 1
+
+    def generate_price_columns(self, sets, required_sets, chunk_rows=65536):
+        """Price the combination space in blocks of whole arrays (requires NumPy).
+
+        Yields one dict per block with the subset of set indexes, an index array
+        (one column per attribute in the subset) and subtotal/discount/vat/totalPrice
+        columns. Rows appear in the same order as generate_combinations, and no
+        block holds more than chunk_rows rows.
+        """
+        import numpy as np
+
+        if chunk_rows < 1:
+            raise ValueError("chunk_rows must be at least 1")
+
+        tables = self.resolve_price_tables(sets)
+        base = float(self.options['basePrice'])
+        price_arrays = [
+            np.array([table.get(value, 0.0) for value in values], dtype=np.float64)
+            for values, table in zip(sets, tables)
+        ]
+        index_dtype = np.uint8 if max((len(values) for values in sets), default=0) <= 256 else np.uint16
+
+        for indexes in self.valid_subsets(sets, required_sets):
+            sizes = [len(sets[i]) for i in indexes]
+            total_rows = 1
+            for size in sizes:
+                total_rows *= size
+            for start in range(0, total_rows, chunk_rows):
+                yield self.price_block(
+                    indexes, sizes, price_arrays, base, start, min(start + chunk_rows, total_rows), index_dtype
+                )
+
+    def price_block(self, indexes, sizes, price_arrays, base, start, stop, index_dtype):
+        """Decode rows [start, stop) of a subset's product and price them as arrays."""
+        import numpy as np
+
+        remainder = np.arange(start, stop, dtype=np.int64)
+        digits = [None] * len(sizes)
+        for position in range(len(sizes) - 1, -1, -1):
+            remainder, digits[position] = np.divmod(remainder, sizes[position])
+
+        # Add prices left to right so totals match the per-SKU path exactly
+        subtotal = np.full(len(digits[0]), base, dtype=np.float64)
+        for position, digit in zip(indexes, digits):
+            subtotal += price_arrays[position][digit]
+
+        block = {
+            'subset': indexes,
+            'indexes': np.stack(digits, axis=1).astype(index_dtype),
+        }
+        block.update(self.adjust_columns(subtotal))
+        return block
+
+    def adjust_columns(self, subtotal):
+        """Apply discount and VAT to an array of subtotals, like apply_adjustments."""
+        import numpy as np
+
+        discount = np.zeros_like(subtotal)
+        if self.options['discount']:
+            if self.options['discountType'] == 'percentage':
+                discount = (self.options['discountAmount'] / 100) * subtotal
+            else:  # Fixed amount
+                discount = np.full_like(subtotal, self.options['discountAmount'])
+
+        vat = np.zeros_like(subtotal)
+        if self.options['vat']:
+            if self.options['vatType'] == 'percentage':
+                vat = ((subtotal - discount) * self.options['vatAmount']) / 100
+            else:  # Fixed amount
+                vat = np.full_like(subtotal, self.options['vatAmount'])
+
+        return {
+            'subtotal': subtotal,
+            'discount': discount,
+            'vat': vat,
+            'totalPrice': subtotal - discount + vat,
+        }
+
+    def block_skus(self, sets, block):
+        """Build the SKU strings for a block from generate_price_columns."""
+        separator = self.options['separator']
+        prefix = self.options['prefixName'] + separator
+        columns = [sets[i] for i in block['subset']]
+        return [
+            prefix + separator.join(values[index] for values, index in zip(columns, row))
+            for row in block['indexes'].tolist()
+        ]
 
-    def get_subsets(self, sets, size):
-        return [list(sets[i] for i in combination) for combination in itertools.combinations(range(len(sets)), size)]
+    def columns_dtype(self, set_count):
+        """Record layout of the binary output: one uint8 per set, then totalPrice."""
+        import numpy as np
 
-    def cartesian_product(self, arrays):
-        return itertools.product(*arrays)
+        return np.dtype([(f"a{i}", np.uint8) for i in range(set_count)] + [('totalPrice', np.float64)])
 
-    def calculate_price(self, combination):
-        subtotal = float(self.options['basePrice'])
+    def write_price_columns(self, filename, sets, required_sets, chunk_rows=65536):
+        """Write the priced catalog as a .npy record array plus a .json sidecar.
+
+        Every row holds one uint8 value index per set (ABSENT_INDEX when the set isn't
+        part of the SKU) and the totalPrice. The sidecar keeps the values, prices and
+        options, so PriceColumns can rebuild SKU strings and the other price columns
+        on request. Returns the number of rows written.
+        """
+        import numpy as np
+
+        if any(len(values) >= self.ABSENT_INDEX for values in sets):
+            raise ValueError(f"binary output supports at most {self.ABSENT_INDEX - 1} values per attribute")
+
+        dtype = self.columns_dtype(len(sets))
+        rows = 0
+        with open(filename, 'wb') as file:
+            # Reserve the header; the row count is only known at the end
+            write_npy_header(file, dtype, rows)
+            for block in self.generate_price_columns(sets, required_sets, chunk_rows):
+                records = np.zeros(len(block['totalPrice']), dtype=dtype)
+                for i in range(len(sets)):
+                    records[f"a{i}"] = self.ABSENT_INDEX
+                for column, i in enumerate(block['subset']):
+                    records[f"a{i}"] = block['indexes'][:, column]
+                records['totalPrice'] = block['totalPrice']
+                file.write(records.tobytes())
+                rows += len(records)
+            file.seek(0)
+            write_npy_header(file, dtype, rows)
+
+        tables = self.resolve_price_tables(sets)
+        with open(sidecar_filename(filename), 'w') as sidecar:
+            json.dump({
+                'rows': rows,
+                'sets': sets,
+                'prices': [[table.get(value, 0.0) for value in values] for values, table in zip(sets, tables)],
+                'options': self.options,
+            }, sidecar)
+        return rows
+
+    def price_distribution(self, sets, required_sets):
+        """Count SKUs per subtotal without generating them.
+
+        Each attribute's prices are folded in one at a time, convolving the running
+        {subtotal: count} table with the attribute's value prices. Optional sets
+        also contribute an "absent" entry priced 0. Prices are counted in whole
+        cents, so the result is {subtotal in cents: number of SKUs}, sorted by
+        subtotal and covering exactly the SKUs generate_combinations yields. In
+        'cents' mode these are the exact cents the rows are priced in.
+        """
+        required = self.required_indexes(sets, required_sets)
+        if not sets or required is None:
+            return {}
+
+        cents_mode = self.options['priceMode'] == 'cents'
+        if cents_mode:
+            tables, base, _ = self.row_pricing(sets)
+        else:
+            tables = self.resolve_price_tables(sets)
+            base = round(float(self.options['basePrice']) * 100)
+        distribution = {base: 1}
+        for i, (values, table) in enumerate(zip(sets, tables)):
+            value_counts = {}
+            if i not in required:
+                value_counts[0] = 1
+            for value in values:
+                cents = table.get(value, 0) if cents_mode else round(table.get(value, 0.0) * 100)
+                value_counts[cents] = value_counts.get(cents, 0) + 1
+
+            folded = {}
+            for subtotal, count in distribution.items():
+                for cents, value_count in value_counts.items():
+                    key = subtotal + cents
+                    folded[key] = folded.get(key, 0) + count * value_count
+            distribution = folded
+
+        # With nothing required the empty subset is skipped, like valid_subsets does
+        if not required:
+            distribution[base] -= 1
+            if not distribution[base]:
+                del distribution[base]
+        return dict(sorted(distribution.items()))
+
+    def adjust_distribution(self, distribution):
+        """Turn a price_distribution into [(totalPrice, number of SKUs)], by subtotal.
+
+        Totals are priced like the rows: integer cents through apply_cents in
+        'cents' mode, floats through apply_adjustments otherwise.
+        """
+        if self.options['priceMode'] == 'cents':
+            return [(self.apply_cents(cents)['totalPrice'], count) for cents, count in distribution.items()]
+        return [(self.apply_adjustments(cents / 100)['totalPrice'], count) for cents, count in distribution.items()]
+
+    def price_stats(self, sets, required_sets):
+        """Return count, min/max/mean totalPrice and min/max subtotal over the catalog.
+
+        In 'cents' mode the prices are integer cents, as in the rows, with the mean
+        rounded to a whole cent.
+        """
+        distribution = self.price_distribution(sets, required_sets)
+        totals = self.adjust_distribution(distribution)
+        count = sum(distribution.values())
+        if not count:
+            return {'count': 0}
+        total_sum = sum(total * n for total, n in totals)
+        if self.options['priceMode'] == 'cents':
+            subtotals = (min(distribution), max(distribution))
+            mean = divide_rounded(total_sum, count)
+        else:
+            subtotals = (min(distribution) / 100, max(distribution) / 100)
+            mean = total_sum / count
+        return {
+            'count': count,
+            'minSubtotal': subtotals[0],
+            'maxSubtotal': subtotals[1],
+            'minTotalPrice': min(total for total, _ in totals),
+            'maxTotalPrice': max(total for total, _ in totals),
+            'meanTotalPrice': mean,
+        }
+
+    def price_histogram(self, sets, required_sets, bins=10):
+        """Split the totalPrice range into equal-width bins: [(low, high, count)].
+
+        Every bin is half open except the last, which includes the maximum. The
+        bounds are in the rows' units, so in cents in 'cents' mode.
+        """
+        if bins < 1:
+            raise ValueError("bins must be at least 1")
+        totals = self.adjust_distribution(self.price_distribution(sets, required_sets))
+        if not totals:
+            return []
+        low = min(total for total, _ in totals)
+        high = max(total for total, _ in totals)
+        width = (high - low) / bins
+        counts = [0] * bins
+        for total, count in totals:
+            position = int((total - low) / width) if width else 0
+            counts[min(position, bins - 1)] += count
+        return [(low + width * i, high if i == bins - 1 else low + width * (i + 1), counts[i]) for i in range(bins)]
+
+    def count_below(self, sets, required_sets, threshold):
+        """Return how many SKUs have a totalPrice below threshold.
+
+        threshold is in currency units in either priceMode, like generate_filtered's range.
+        """
+        totals = self.adjust_distribution(self.price_distribution(sets, required_sets))
+        scale = 100 if self.options['priceMode'] == 'cents' else 1
+        return sum(count for total, count in totals if total / scale < threshold)
+
+    def top_k(self, sets, required_sets, k, order='asc', filters=None):
+        """Return the k cheapest (order='asc') or dearest ('desc') SKUs, as generate_combinations rows.
+
+        Every attribute becomes a list of choices sorted by price, with an extra
+        "absent" choice priced 0 for optional attributes, and the product of those
+        lists is searched best-first from its cheapest (or dearest) corner. Each
+        popped tuple pushes at most one neighbour per attribute, so only about
+        k * attributes candidates are priced. Results come out in the order a stable
+        sort of the full output by totalPrice gives, ties in generation order.
+
+        filters maps attribute names to the values allowed for them; a filtered
+        attribute must be present with one of those values.
+        """
+        if order not in ('asc', 'desc'):
+            raise ValueError("order must be 'asc' or 'desc'")
+        required = self.required_indexes(sets, required_sets)
+        if k < 1 or not sets or required is None:
+            return []
+
+        allowed = self.filter_values(sets, filters or {})
+        # Search on the prices the rows are priced from: cents in 'cents' mode, floats otherwise
+        tables, base, adjust = self.row_pricing(sets)
+        cents = self.options['priceMode'] == 'cents'
+        # totalPrice is a linear function of the subtotal; follow its direction
+        slope = self.apply_adjustments(1.0)['totalPrice'] - self.apply_adjustments(0.0)['totalPrice']
+        sign = 1 if (order == 'asc') == (slope >= 0) else -1
+        direction = 1 if order == 'asc' else -1
+
+        # choices[i]: (signed price, value position or None for absent)
+        choices = []
+        for i, (values, table) in enumerate(zip(sets, tables)):
+            attribute_choices = [
+                (sign * table.get(value, 0), position)
+                for position, value in enumerate(values)
+                if allowed[i] is None or value in allowed[i]
+            ]
+            if i not in required and allowed[i] is None:
+                attribute_choices.append((0, None))
+            if not attribute_choices:
+                return []
+            attribute_choices.sort(key=lambda choice: choice[0])
+            choices.append(attribute_choices)
+
+        # Successors only advance attributes at or after the last one advanced, so
+        # every tuple in the lattice has exactly one parent and is pushed once
+        start = (0,) * len(choices)
+        frontier = [(sum(attribute_choices[0][0] for attribute_choices in choices), start, 0)]
+        found = []
+        # Negated sort prices of the k best SKUs found so far; -cutoff[0] is the k-th
+        cutoff = []
+        while frontier:
+            cost, positions, last = heapq.heappop(frontier)
+            if len(cutoff) >= k:
+                # Nothing left can sort before the k-th SKU found. Float sums depend on
+                # the order they're added in, so leave some slack for SKUs that tie
+                bound = direction * adjust(base + sign * cost)['totalPrice']
+                if not cents:
+                    bound -= self.TOP_K_SLACK * (1 + abs(bound))
+                if bound > -cutoff[0]:
+                    break
+            picked = [attribute_choices[p][1] for attribute_choices, p in zip(choices, positions)]
+            if any(position is not None for position in picked):
+                # Price it as the row is priced, adding the prices in attribute order
+                combination = [(i, sets[i][position]) for i, position in enumerate(picked) if position is not None]
+                subtotal = base
+                for i, value in combination:
+                    subtotal += tables[i].get(value, 0)
+                price = adjust(subtotal)
+                found.append((direction * price['totalPrice'], self.generation_key(picked, required), combination, price))
+                heapq.heappush(cutoff, -direction * price['totalPrice'])
+                if len(cutoff) > k:
+                    heapq.heappop(cutoff)
+            for i in range(last, len(choices)):
+                if positions[i] + 1 < len(choices[i]):
+                    step = choices[i][positions[i] + 1][0] - choices[i][positions[i]][0]
+                    heapq.heappush(frontier, (cost + step, positions[:i] + (positions[i] + 1,) + positions[i + 1:], i))
+
+        # Ties at the cut-off were all collected above; settle them in generation order
+        found.sort(key=lambda entry: entry[:2])
+        separator = self.options['separator']
+        rows = []
+        for _, _, combination, price in found[:k]:
+            sku = separator.join(value for _, value in combination)
+            rows.append([self.options['prefixName'] + separator + sku, price])
+        return rows
+
+    def filter_values(self, sets, filters):
+        """Turn {attribute name: allowed values} into a per-set list of allowed sets (None = any)."""
+        allowed = [None] * len(sets)
+        names = {}
+        for i, index in enumerate(self.resolve_attributes(sets)):
+            if index is not None:
+                names[self.attributes[index]['name']] = i
+        for name, values in filters.items():
+            if name not in names:
+                raise ValueError(f"unknown attribute {name!r}")
+            allowed[names[name]] = set(values)
+        return allowed
+
+    def generation_key(self, picked, required):
+        """Sort key giving the position of a SKU in generate_combinations order."""
+        subset = [i for i, position in enumerate(picked) if position is not None]
+        chosen = tuple(i for i in subset if i not in required)
+        return len(subset), chosen, tuple(picked[i] for i in subset)
+
+    def build_price_tables(self):
+        """Build a value -> price table for every attribute, in attribute order."""
+        tables = []
+        for attribute in self.attributes:
+            table = {}
+            for attribute_value in attribute['values']:
+                price = float(attribute_value['price']) if 'price' in attribute_value else 0.0
+                table[attribute_value['value']] = table.get(attribute_value['value'], 0.0) + price
+            tables.append(table)
+        return tables
+
+    def build_cent_tables(self):
+        """Build value -> integer cents tables, parsed exactly from the price strings."""
+        tables = []
+        for attribute in self.attributes:
+            table = {}
+            for attribute_value in attribute['values']:
+                where = f"attribute {attribute.get('name')!r} value {attribute_value['value']!r}"
+                cents = parse_cents(attribute_value.get('price', 0), where)
+                table[attribute_value['value']] = table.get(attribute_value['value'], 0) + cents
+            tables.append(table)
+        return tables
+
+    def build_value_prices(self, price_tables=None):
+        """Merge the per-attribute tables for lookups that don't know the attribute."""
+        value_prices = {}
+        for table in self.price_tables if price_tables is None else price_tables:
+            for value, price in table.items():
+                value_prices[value] = value_prices.get(value, 0) + price
+        return value_prices
+
+    def resolve_attributes(self, sets):
+        """Return the index of the attribute each set of values came from, or None.
+
+        Sets from prepare_sets carry their attribute's index. Plain lists are matched
+        to an unused enabled attribute with the same values, in attribute order.
+        """
+        resolved = [getattr(values, 'attribute', None) for values in sets]
+        used = {index for index in resolved if index is not None}
+        for i, values in enumerate(sets):
+            if resolved[i] is not None:
+                continue
+            for index, attribute in enumerate(self.attributes):
+                if (index not in used and attribute['enabled']
+                        and [v['value'] for v in attribute['values']] == list(values)):
+                    used.add(index)
+                    resolved[i] = index
+                    break
+        return resolved
+
+    def resolve_price_tables(self, sets):
+        """Match each set of values to the price table of the attribute it came from."""
+        self.refresh_attributes()
+        # Sets that don't belong to a single attribute fall back to the merged table
+        return [
+            self.price_tables[index] if index is not None else self.value_prices
+            for index in self.resolve_attributes(sets)
+        ]
+
+    def row_pricing(self, sets):
+        """Return (tables, base subtotal, adjust) for pricing rows in the current priceMode.
+
+        In 'cents' mode the tables and subtotals are integer cents and adjust is
+        apply_cents; otherwise they're floats and adjust is apply_adjustments. Both
+        return a new price dict per call.
+        """
+        if self.options['priceMode'] == 'cents':
+            self.refresh_attributes()
+            tables = [
+                self.cent_tables[index] if index is not None else self.value_cents
+                for index in self.resolve_attributes(sets)
+            ]
+            self.build_cent_rates()
+            return tables, self.base_cents(), self.apply_cents
+        return self.resolve_price_tables(sets), float(self.options['basePrice']), self.apply_adjustments
+
+    def base_cents(self):
+        return parse_cents(self.options['basePrice'], "option 'basePrice'")
+
+    def calculate_price(self, combination, tables=None):
+        """Price a combination; tables, when given, must match the current priceMode."""
+        cents = self.options['priceMode'] == 'cents'
+        subtotal = self.base_cents() if cents else float(self.options['basePrice'])
 
         # Add prices of selected attribute values
-        for value in combination:
-            for attribute in self.attributes:
-                for attribute_value in attribute['values']:
-                    if attribute_value['value'] == value and 'price' in attribute_value:
-                        subtotal += float(attribute_value['price'])
+        if tables is None:
+            self.refresh_attributes()
+            value_prices = self.value_cents if cents else self.value_prices
+            for value in combination:
+                subtotal += value_prices.get(value, 0)
+        else:
+            for value, table in zip(combination, tables):
+                subtotal += table.get(value, 0)
+
+        return self.apply_cents(subtotal) if cents else self.apply_adjustments(subtotal)
 
+    def apply_adjustments(self, subtotal):
+        """Apply discount and VAT to a subtotal and return the price breakdown."""
         # Apply discount if enabled
         discount = 0
         if self.options['discount']:
@@ -85,6 +1268,50 @@ class GenerateSku:
             'totalPrice': total_price
         }
 
+    def apply_cents(self, subtotal):
+        """apply_adjustments for a subtotal in integer cents.
+
+        Percentage discounts and VAT are worked out exactly and rounded half away
+        from zero to whole cents; fixed amounts are converted to cents as given.
+        """
+        if self.cent_rates_version != self._options.version:
+            self.build_cent_rates()
+        discount_rate, vat_rate = self.cent_rates
+
+        discount = 0
+        if discount_rate is not None:
+            numerator, denominator = discount_rate
+            discount = divide_rounded(subtotal * numerator, denominator) if denominator else numerator
+
+        vat = 0
+        if vat_rate is not None:
+            numerator, denominator = vat_rate
+            vat = divide_rounded((subtotal - discount) * numerator, denominator) if denominator else numerator
+
+        return {
+            'subtotal': subtotal,
+            'discount': discount,
+            'vat': vat,
+            'totalPrice': subtotal - discount + vat
+        }
+
+    def build_cent_rates(self):
+        """Turn the discount and VAT options into (numerator, denominator) pairs for apply_cents.
+
+        A percentage becomes the exact ratio amount / 100; a fixed amount becomes
+        (cents, 0). Disabled adjustments are None.
+        """
+        rates = []
+        for name in ('discount', 'vat'):
+            if not self.options[name]:
+                rates.append(None)
+            elif self.options[f"{name}Type"] == 'percentage':
+                rates.append((Decimal(str(self.options[f"{name}Amount"])) / 100).as_integer_ratio())
+            else:
+                rates.append((parse_cents(self.options[f"{name}Amount"], f"option '{name}Amount'"), 0))
+        self.cent_rates = rates
+        self.cent_rates_version = self._options.version
+
     def get_memory_usage(self):
         return f"{self.get_memory_in_mb()} MB"
 
@@ -412,34 +1639,548 @@ attributes = [
         }
     ]
 
-# Prepare sets and required_sets
-sets = []
-required_sets = []
-for attribute in attributes:
-    if attribute['enabled']:
-        values = [v['value'] for v in attribute['values']]
-        if values:
-            sets.append(values)
-            if attribute['required']:
-                required_sets.append(values)
-
-# Generate combinations and write to a file
-timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-filename = f"output/python-price.txt"
-
-try:
-    with open(filename, 'w') as file:
-        file.write("SKU, Subtotal, Total Price, VAT, Discount, Memory Usage\n")
-
-        sku_generator = GenerateSku(attributes)
-        for combination in sku_generator.generate_combinations(sets, required_sets):
-            sku = combination[0].upper() if sku_generator.options['uppercase'] else combination[0].lower()
-            price_details = combination[1]
-
-            log_entry = f"{sku}, {price_details['subtotal']}, {price_details['totalPrice']}, {price_details['vat']}, {price_details['discount']}, {sku_generator.get_memory_usage()}\n"
-            print(log_entry.strip())
-            file.write(log_entry)
-
-    print(f"Combinations written to {filename}")
-except Exception as e:
-    print(f"Error: {e}")
+class PriceColumns:
+    """Read a catalog written by GenerateSku.write_price_columns (requires NumPy).
+
+    Records are memory-mapped by default. SKU strings and the subtotal, discount and
+    vat columns are only built for the rows asked for.
+    """
+
+    def __init__(self, filename, mmap_mode='r'):
+        import numpy as np
+
+        with open(sidecar_filename(filename), 'r') as sidecar:
+            self.meta = json.load(sidecar)
+        self.records = np.load(filename, mmap_mode=mmap_mode)
+        self.sets = self.meta['sets']
+        self.sku_generator = GenerateSku([])
+        self.sku_generator.options.update(self.meta['options'])
+
+        # Absent sets look up ABSENT_INDEX, which prices at 0.0
+        self.price_arrays = []
+        for prices in self.meta['prices']:
+            price_array = np.zeros(GenerateSku.ABSENT_INDEX + 1, dtype=np.float64)
+            price_array[:len(prices)] = prices
+            self.price_arrays.append(price_array)
+
+    def __len__(self):
+        return len(self.records)
+
+    def skus(self, start=0, stop=None):
+        """Build the SKU strings for rows [start, stop), as the text output writes them."""
+        options = self.sku_generator.options
+        separator = options['separator']
+        records = self.records[start:stop]
+        columns = [records[f"a{i}"].tolist() for i in range(len(self.sets))]
+        skus = []
+        for row in zip(*columns):
+            sku = options['prefixName'] + separator + separator.join(
+                values[index] for values, index in zip(self.sets, row) if index != GenerateSku.ABSENT_INDEX
+            )
+            skus.append(sku.upper() if options['uppercase'] else sku.lower())
+        return skus
+
+    def prices(self, start=0, stop=None):
+        """Return the subtotal, discount, vat and totalPrice columns for rows [start, stop)."""
+        import numpy as np
+
+        records = self.records[start:stop]
+        subtotal = np.full(len(records), float(self.sku_generator.options['basePrice']), dtype=np.float64)
+        for i, price_array in enumerate(self.price_arrays):
+            subtotal += price_array[records[f"a{i}"]]
+        columns = self.sku_generator.adjust_columns(subtotal)
+        columns['totalPrice'] = np.asarray(records['totalPrice'])
+        return columns
+
+
+def divide_rounded(numerator, denominator):
+    """Divide integers, rounding halves away from zero (denominator > 0)."""
+    quotient, remainder = divmod(abs(numerator), denominator)
+    if 2 * remainder >= denominator:
+        quotient += 1
+    return quotient if numerator >= 0 else -quotient
+
+
+def format_cents(cents):
+    """Format integer cents as 1234.05 without going through float."""
+    if cents < 0:
+        return '-' + format_cents(-cents)
+    return str(cents // 100) + CENT_SUFFIXES[cents % 100]
+
+
+@functools.lru_cache(maxsize=65536)
+def format_cent_columns(subtotal, total_price, vat, discount):
+    """Format the four cents price columns of a row; rows repeat a few hundred price sets."""
+    return f"{format_cents(subtotal)}, {format_cents(total_price)}, {format_cents(vat)}, {format_cents(discount)}"
+
+
+def sidecar_filename(filename):
+    return os.path.splitext(filename)[0] + '.json'
+
+
+def write_npy_header(file, dtype, rows):
+    """Write a .npy 1.0 header padded so it can be rewritten with any row count."""
+    import numpy as np
+
+    def header(count):
+        return "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (np.lib.format.dtype_to_descr(dtype), count)
+
+    size = len(header(2 ** 63 - 1)) + 1
+    size += -(len(np.lib.format.magic(1, 0)) + 2 + size) % 64
+    file.write(np.lib.format.magic(1, 0) + struct.pack('<H', size) + (header(rows).ljust(size - 1) + '\n').encode('latin1'))
+
+
+def add_instrument_arguments(parser):
+    parser.add_argument('--instrument', nargs='?', const='output/python-price-metrics.json', metavar='PATH',
+                        help="time the enumerate/filter/price/format/write stages of a text run and write a "
+                             "JSON summary to PATH (default: output/python-price-metrics.json)")
+    parser.add_argument('--profile', choices=['cprofile', 'tracemalloc'],
+                        help="also add the top cProfile functions or tracemalloc allocations to the summary "
+                             "(implies --instrument)")
+
+
+def load_generator(data_filename=None):
+    """Build the generator from a data.json catalog, or from the attributes above."""
+    if not data_filename:
+        return GenerateSku(attributes)
+    catalog = load_catalog(data_filename)
+    sku_generator = GenerateSku(catalog)
+    sku_generator.options.update(catalog.options)
+    return sku_generator
+
+
+def catalog_changes(old_generator, new_generator):
+    """Compare two generators' catalogs value by value.
+
+    Returns (old sets, old required sets, new sets, new required sets, removed,
+    added, repriced), the last three holding one set of values per set. Changes
+    other than values being added, removed or repriced, such as options or the
+    enabled attributes, affect every SKU and raise ValueError instead.
+    """
+    if old_generator.options != new_generator.options:
+        raise ValueError("the options changed; regenerate the full catalog")
+
+    def enabled(generator):
+        return [(a['name'], a['required']) for a in generator.attributes if a['enabled'] and a['values']]
+
+    if enabled(old_generator) != enabled(new_generator):
+        raise ValueError("the enabled or required attributes changed; regenerate the full catalog")
+
+    old_sets, old_required = prepare_sets(old_generator.attributes)
+    new_sets, new_required = prepare_sets(new_generator.attributes)
+    old_tables = old_generator.resolve_price_tables(old_sets)
+    new_tables = new_generator.resolve_price_tables(new_sets)
+    removed = []
+    added = []
+    repriced = []
+    for old_values, new_values, old_table, new_table in zip(old_sets, new_sets, old_tables, new_tables):
+        removed.append(set(old_values) - set(new_values))
+        added.append(set(new_values) - set(old_values))
+        repriced.append({
+            value for value in set(old_values) & set(new_values)
+            if round(old_table.get(value, 0.0) * 100) != round(new_table.get(value, 0.0) * 100)
+        })
+    return old_sets, old_required, new_sets, new_required, removed, added, repriced
+
+
+def diff_catalogs(old_generator, new_generator):
+    """Yield (change, SKU, old price, new price) for the SKUs a catalog edit affects.
+
+    change is 'removed', 'added' or 'repriced'; the missing side's price is None.
+    Only the SKUs holding a changed value are generated, on either side.
+    """
+    old_sets, old_required, new_sets, new_required, removed, added, repriced = catalog_changes(
+        old_generator, new_generator
+    )
+    old_tables, _, old_adjust = old_generator.row_pricing(old_sets)
+    new_adjust = new_generator.row_pricing(new_sets)[2]
+    separator = new_generator.options['separator']
+    prefix = new_generator.options['prefixName'] + separator
+
+    # Old side: SKUs holding a removed value are gone
+    for indexes, combination, subtotal in old_generator.touching_product(old_sets, old_required, removed):
+        yield 'removed', prefix + separator.join(combination), old_adjust(subtotal), None
+
+    # New side: SKUs holding an added value are new; the rest only changed price
+    touched = [new | changed for new, changed in zip(added, repriced)]
+    for indexes, combination, subtotal in new_generator.touching_product(new_sets, new_required, touched):
+        sku = prefix + separator.join(combination)
+        price = new_adjust(subtotal)
+        if any(value in added[i] for i, value in zip(indexes, combination)):
+            yield 'added', sku, None, price
+            continue
+        old_price = old_generator.calculate_price(combination, [old_tables[i] for i in indexes])
+        if old_price['totalPrice'] != price['totalPrice']:
+            yield 'repriced', sku, old_price, price
+
+
+def format_change(sku_generator, change):
+    kind, sku, old_price, new_price = change
+    sku = sku.upper() if sku_generator.options['uppercase'] else sku.lower()
+    format_price = format_cents if sku_generator.options['priceMode'] == 'cents' else str
+    old_total = format_price(old_price['totalPrice']) if old_price else ''
+    new_total = format_price(new_price['totalPrice']) if new_price else ''
+    return f"{kind}, {sku}, {old_total}, {new_total}"
+
+
+def prepare_sets(attributes):
+    """Prepare sets and required_sets from the enabled attributes.
+
+    Every set is an AttributeValues list carrying its attribute's index.
+    """
+    sets = []
+    required_sets = []
+    for index, attribute in enumerate(attributes):
+        if attribute['enabled']:
+            values = AttributeValues((v['value'] for v in attribute['values']), index)
+            if values:
+                sets.append(values)
+                if attribute['required']:
+                    required_sets.append(values)
+    return sets, required_sets
+
+
+def format_entry(sku_generator, combination):
+    sku = combination[0].upper() if sku_generator.options['uppercase'] else combination[0].lower()
+    price_details = combination[1]
+
+    if sku_generator.options['priceMode'] == 'cents':
+        prices = format_cent_columns(
+            price_details['subtotal'], price_details['totalPrice'], price_details['vat'], price_details['discount']
+        )
+        return f"{sku}, {prices}, {sku_generator.get_memory_usage()}"
+    return f"{sku}, {price_details['subtotal']}, {price_details['totalPrice']}, {price_details['vat']}, {price_details['discount']}, {sku_generator.get_memory_usage()}"
+
+
+def write_entries(writer, sku_generator, combinations, instruments=None):
+    """Format [sku, price] rows with format_entry and queue them on writer."""
+    if instruments is None:
+        for combination in combinations:
+            writer.write(format_entry(sku_generator, combination))
+        return
+    clock = time.perf_counter_ns
+    for combination in combinations:
+        started = clock()
+        row = format_entry(sku_generator, combination)
+        instruments.add('format', clock() - started, 1)
+        writer.write(row)
+
+
+def format_block(sku_generator, block):
+    """Format a RecordBlock as newline-terminated rows, exactly as format_entry would."""
+    upper = sku_generator.options['uppercase']
+    memory = sku_generator.get_memory_usage()
+    if sku_generator.options['priceMode'] == 'cents':
+        tails = map(format_cent_columns, block.subtotal, block.totalPrice, block.column('vat'), block.column('discount'))
+    else:
+        tails = map(format_float_columns, block.subtotal, block.totalPrice, block.column('vat'), block.column('discount'))
+    skus = block.skus
+    skus = [sku.upper() for sku in skus] if upper else [sku.lower() for sku in skus]
+    return ''.join(f"{sku}, {tail}, {memory}\n" for sku, tail in zip(skus, tails))
+
+
+@functools.lru_cache(maxsize=65536, typed=True)
+def format_float_columns(subtotal, total_price, vat, discount):
+    """Format the four float price columns of a row; rows repeat a few hundred price sets."""
+    return f"{subtotal}, {total_price}, {vat}, {discount}"
+
+
+def generate_shard(shard_filename, attributes, options, sets, tasks, batch_rows, buffer_size):
+    """Worker: write the rows for one range of tasks to its own shard file.
+
+    attributes is the generator's Catalog when it was loaded from one, else its attribute list.
+    """
+    sku_generator = GenerateSku(attributes)
+    sku_generator.options.update(options)
+    with open(shard_filename, 'w', buffering=buffer_size) as shard:
+        writer = BlockWriter(shard, echo=False, batch_rows=batch_rows)
+        for combination in sku_generator.generate_tasks(sets, tasks):
+            writer.write(format_entry(sku_generator, combination))
+        writer.flush()
+    return shard_filename
+
+
+def write_sharded(writer, filename, sku_generator, sets, required_sets, workers, buffer_size):
+    """Generate shards in worker processes and append them to file in serial order."""
+    shards = sku_generator.plan_shards(sets, workers, required_sets)
+    shard_filenames = [f"{filename}.part{i}" for i in range(len(shards))]
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    generate_shard, shard_filename, sku_generator.catalog or sku_generator.attributes,
+                    sku_generator.options, sets, tasks, writer.batch_rows, buffer_size
+                )
+                for shard_filename, tasks in zip(shard_filenames, shards)
+            ]
+            for future in futures:
+                with open(future.result(), 'r') as shard:
+                    for block in iter(lambda: shard.read(buffer_size), ''):
+                        writer.write_block(block)
+    finally:
+        for shard_filename in shard_filenames:
+            if os.path.exists(shard_filename):
+                os.remove(shard_filename)
+
+
+def parse_filters(expressions):
+    """Parse --where NAME=V1,V2 expressions into top_k filters."""
+    filters = {}
+    for expression in expressions:
+        name, separator, values = expression.partition('=')
+        if not separator or not name:
+            raise ValueError(f"filter {expression!r} must look like NAME=V1,V2")
+        filters[name] = values.split(',')
+    return filters
+
+
+def parse_pairs(expressions):
+    """Parse --exclude VALUE1,VALUE2 expressions into generate_filtered pairs."""
+    pairs = []
+    for expression in expressions:
+        values = expression.split(',')
+        if len(values) != 2 or not all(values):
+            raise ValueError(f"excluded pair {expression!r} must look like VALUE1,VALUE2")
+        pairs.append(tuple(values))
+    return pairs
+
+
+def measure_row_memory(sku_generator, sets, required_sets, rows):
+    """Return [(representation, bytes per SKU)] for holding the first rows SKUs in memory.
+
+    tracemalloc counts what stays allocated once the rows are collected: the
+    [sku, dict] rows of generate_combinations, PriceRecords, and RecordBlocks.
+    """
+    import tracemalloc
+
+    def rows_of(generator):
+        return list(itertools.islice(generator, rows))
+
+    def blocks():
+        kept = []
+        count = 0
+        for block in sku_generator.generate_record_blocks(sets, required_sets, min(rows, 4096)):
+            kept.append(block)
+            count += len(block)
+            if count >= rows:
+                break
+        return kept
+
+    results = []
+    for name, collect in (
+        ('rows', lambda: rows_of(sku_generator.generate_combinations(sets, required_sets))),
+        ('records', lambda: rows_of(sku_generator.generate_records(sets, required_sets))),
+        ('record blocks', blocks),
+    ):
+        tracemalloc.start()
+        kept = collect()
+        held = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results.append((name, held / max(rows, 1)))
+        del kept
+    return results
+
+
+def print_stats(sku_generator, sets, required_sets, bins=0, thresholds=()):
+    stats = sku_generator.price_stats(sets, required_sets)
+    print(f"SKUs: {stats['count']}")
+    if not stats['count']:
+        return
+    if sku_generator.options['priceMode'] == 'cents':
+        # Integer cents, formatted like the price columns of the rows
+        price, mean, scale = format_cents, format_cents, 100
+    else:
+        price, mean, scale = str, '{:.2f}'.format, 1
+    print(f"Subtotal: {price(stats['minSubtotal'])} - {price(stats['maxSubtotal'])}")
+    print(f"Total Price: {price(stats['minTotalPrice'])} - {price(stats['maxTotalPrice'])}, "
+          f"mean {mean(stats['meanTotalPrice'])}")
+    for threshold in thresholds:
+        print(f"Below {threshold}: {sku_generator.count_below(sets, required_sets, threshold)}")
+    if bins:
+        for low, high, count in sku_generator.price_histogram(sets, required_sets, bins):
+            print(f"{low / scale:12.2f} - {high / scale:12.2f}: {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate SKUs with prices.")
+    parser.add_argument('--workers', type=int, default=1, help="number of worker processes (default: 1)")
+    parser.add_argument('--format', choices=['text', 'npy'], default='text',
+                        help="text rows, or uint8 index columns plus totalPrice in a .npy file (requires numpy)")
+    parser.add_argument('--data', metavar='PATH',
+                        help="load attributes and options from a data.json catalog instead of the built-in ones")
+    parser.add_argument('--stats', action='store_true',
+                        help="print price statistics computed from the attribute prices, without generating")
+    parser.add_argument('--histogram', type=int, default=0, metavar='BINS',
+                        help="with --stats, also print a totalPrice histogram with BINS bins")
+    parser.add_argument('--under', type=float, action='append', default=[], metavar='PRICE',
+                        help="with --stats, also count the SKUs with a totalPrice below PRICE")
+    parser.add_argument('--top', type=int, default=0, metavar='K',
+                        help="print only the K cheapest SKUs (or dearest, with --order desc)")
+    parser.add_argument('--order', choices=['asc', 'desc'], default='asc', help="sort order for --top")
+    parser.add_argument('--where', action='append', default=[], metavar='NAME=V1,V2',
+                        help="with --top, only SKUs whose attribute NAME is one of the listed values")
+    parser.add_argument('--min-price', type=float, metavar='PRICE',
+                        help="only write SKUs with a totalPrice of at least PRICE (text output)")
+    parser.add_argument('--max-price', type=float, metavar='PRICE',
+                        help="only write SKUs with a totalPrice of at most PRICE (text output)")
+    parser.add_argument('--exclude', action='append', default=[], metavar='VALUE1,VALUE2',
+                        help="skip SKUs that hold both values, e.g. RSH,NRH (repeatable)")
+    parser.add_argument('--price-mode', choices=['float', 'cents'], default='float',
+                        help="float prices as before, or exact integer cents with prices written as 1234.50")
+    parser.add_argument('--diff', metavar='OLD_PATH',
+                        help="write only the SKUs added, removed or repriced since the OLD_PATH data.json catalog")
+    parser.add_argument('--memory-benchmark', type=int, default=0, metavar='ROWS',
+                        help="compare the bytes held per SKU by rows, records and record blocks (tracemalloc)")
+    add_output_arguments(parser)
+    add_checkpoint_arguments(parser)
+    add_instrument_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        sku_generator = load_generator(args.data)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        return
+    sku_generator.options['priceMode'] = args.price_mode
+    sets, required_sets = prepare_sets(sku_generator.attributes)
+
+    if args.stats:
+        try:
+            print_stats(sku_generator, sets, required_sets, args.histogram, args.under)
+        except ValueError as e:
+            print(f"Error: {e}")
+        return
+
+    if args.memory_benchmark:
+        for name, per_sku in measure_row_memory(sku_generator, sets, required_sets, args.memory_benchmark):
+            print(f"{name}: {per_sku:.1f} bytes per SKU")
+        return
+
+    if args.top:
+        try:
+            filters = parse_filters(args.where)
+            for combination in sku_generator.top_k(sets, required_sets, args.top, args.order, filters):
+                print(format_entry(sku_generator, combination))
+        except ValueError as e:
+            print(f"Error: {e}")
+        return
+
+    if args.diff:
+        filename = "output/python-price-diff.txt"
+        try:
+            old_generator = load_generator(args.diff)
+            old_generator.options['priceMode'] = args.price_mode
+            with open(filename, 'w', buffering=args.buffer_size) as file:
+                file.write("Change, SKU, Old Total Price, New Total Price\n")
+                writer = BlockWriter(file, echo=not args.quiet, batch_rows=args.batch_rows)
+                for change in diff_catalogs(old_generator, sku_generator):
+                    writer.write(format_change(sku_generator, change))
+                writer.flush()
+            print(f"Changes written to {filename}")
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+        return
+
+    try:
+        excluded_pairs = parse_pairs(args.exclude)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    filtered = args.min_price is not None or args.max_price is not None or excluded_pairs
+
+    # Generate combinations and write to a file
+    filename = f"output/python-price.txt"
+
+    if args.format == 'npy':
+        if args.price_mode == 'cents':
+            print("Error: --format npy stores float prices; use --price-mode float")
+            return
+        filename = f"output/python-price.npy"
+        try:
+            rows = sku_generator.write_price_columns(filename, sets, required_sets)
+            print(f"{rows} combinations written to {filename}")
+        except Exception as e:
+            print(f"Error: {e}")
+        return
+
+    # Only the plain text walk has positions to checkpoint; --resume truncates back to the last one
+    resumable = not filtered and args.workers == 1
+    run = run_key(sets, sku_generator.required_indexes(sets, required_sets), dict(sku_generator.options), 'text')
+
+    def position(rows):
+        return sku_generator.walk_position(sets, required_sets, rows) if sets else {}
+
+    start = 0
+    if args.resume:
+        if not resumable:
+            print("Error: --resume only continues plain text runs (no --workers, price filters or --exclude)")
+            return
+        try:
+            start = resume_output(filename, run, position)['rows']
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            return
+        print(f"Resuming after {start} rows")
+
+    instruments = None
+    if args.profile and not args.instrument:
+        args.instrument = 'output/python-price-metrics.json'
+    if args.instrument:
+        instruments = Instruments(args.profile)
+        sku_generator.instruments = instruments
+        instruments.start()
+
+    try:
+        with open(filename, 'a' if args.resume else 'w', buffering=args.buffer_size) as file:
+            first_byte = file.tell()
+            if not args.resume:
+                file.write("SKU, Subtotal, Total Price, VAT, Discount, Memory Usage\n")
+
+            checkpointer = None
+            if resumable and args.checkpoint_every:
+                checkpointer = Checkpointer(file, filename, args.checkpoint_every, position, run)
+            writer = BlockWriter(
+                file, echo=not args.quiet, batch_rows=args.batch_rows, checkpoint=checkpointer, instruments=instruments
+            )
+            writer.rows_written = start
+            if filtered:
+                combinations = sku_generator.generate_filtered(
+                    sets, required_sets, args.min_price, args.max_price, excluded_pairs
+                )
+                if instruments is not None:
+                    combinations = instruments.timed(combinations, 'filter')
+                write_entries(writer, sku_generator, combinations, instruments)
+            elif args.workers > 1 and sets:
+                write_sharded(writer, filename, sku_generator, sets, required_sets, args.workers, args.buffer_size)
+            elif not sets:
+                combinations = sku_generator.generate_combinations(sets, required_sets)
+                write_entries(writer, sku_generator, itertools.islice(combinations, start, None), instruments)
+            else:
+                blocks = sku_generator.generate_record_blocks(sets, required_sets, args.batch_rows, start)
+                if instruments is None:
+                    for block in blocks:
+                        writer.write_block(format_block(sku_generator, block))
+                else:
+                    clock = time.perf_counter_ns
+                    for block in blocks:
+                        started = clock()
+                        text = format_block(sku_generator, block)
+                        instruments.add('format', clock() - started, len(block))
+                        writer.write_block(text)
+            writer.flush()
+            output_bytes = file.tell() - first_byte
+        remove_checkpoint(filename)
+
+        print(f"Combinations written to {filename}")
+        if instruments is not None:
+            instruments.stop()
+            summary = instruments.summary(writer.rows_written - start, output_bytes)
+            with open(args.instrument, 'w') as metrics:
+                json.dump(summary, metrics, indent=4)
+            print(f"Instrumentation summary written to {args.instrument}")
+    except Exception as e:
+        print(f"Error: {e}")
+
+
+if __name__ == '__main__':
+    main()
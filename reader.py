@@ -0,0 +1,204 @@
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+
+# Index layout: header, then row offsets (rows + 1 of them), then the hash table slots
+INDEX_MAGIC = b'SKUIDX1\0'
+INDEX_HEADER = struct.Struct('<8sQQQQQ')  # magic, source size, source mtime_ns, header rows, rows, slots
+
+
+class CatalogReader:
+    """Memory-mapped access to a text catalog written by price.py, sku.py or sku-new.py.
+
+    A sidecar index (<file>.idx) holds the byte offset of every row and an open
+    addressing hash table over the SKU column, so row(i) and index_of(sku) only touch
+    a few pages of the catalog instead of reading it into memory. The index is built
+    on first use and rebuilt when the catalog changes.
+    """
+
+    def __init__(self, filename, index_filename=None, rank=None):
+        self.filename = filename
+        self.index_filename = index_filename or f"{filename}.idx"
+        # rank(sku) -> row, e.g. GenerateSku.index_of, replaces the hash table lookup
+        self.rank = rank
+
+        self.file = open(filename, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        if not self.index_is_current():
+            self.build_index()
+        self.open_index()
+
+    def close(self):
+        self.offsets.release()
+        self.slots.release()
+        self.index.close()
+        self.index_file.close()
+        if self.data:
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.rows
+
+    def row(self, index):
+        """Return row index (0-based, header excluded) without its trailing newline."""
+        if index < 0:
+            index += self.rows
+        if not 0 <= index < self.rows:
+            raise IndexError("row index out of range")
+        start = self.offsets[self.header_rows + index]
+        end = self.offsets[self.header_rows + index + 1]
+        return self.data[start:end].rstrip(b'\n').decode()
+
+    def sku(self, index):
+        return self.row_key(self.row(index).encode()).decode()
+
+    def index_of(self, sku):
+        """Return the first row whose SKU column equals sku."""
+        if self.rank is not None:
+            index = self.rank(sku)
+            # A rank past the end of the file (e.g. a partial run) isn't in it either
+            if not 0 <= index < self.rows or self.sku(index) != sku:
+                raise ValueError(f"{sku!r} is not in {self.filename}")
+            return index
+
+        key = sku.encode()
+        mask = self.slot_count - 1
+        slot = sku_hash(key) & mask
+        while True:
+            entry = self.slots[slot]
+            if entry == 0:
+                raise ValueError(f"{sku!r} is not in {self.filename}")
+            index = entry - 1
+            start = self.offsets[self.header_rows + index]
+            end = self.offsets[self.header_rows + index + 1]
+            if self.row_key(self.data[start:end].rstrip(b'\n')) == key:
+                return index
+            slot = (slot + 1) & mask
+
+    def find(self, sku):
+        """Return the row for sku, or None when it isn't in the catalog."""
+        try:
+            return self.row(self.index_of(sku))
+        except ValueError:
+            return None
+
+    def row_key(self, line):
+        """Pull the SKU out of a row: "time | SKU | memory", "SKU, prices..." or a bare SKU."""
+        if b' | ' in line:
+            return line.split(b' | ', 2)[1]
+        return line.split(b', ', 1)[0]
+
+    def index_is_current(self):
+        if not os.path.exists(self.index_filename):
+            return False
+        with open(self.index_filename, 'rb') as index:
+            header = index.read(INDEX_HEADER.size)
+        if len(header) < INDEX_HEADER.size:
+            return False
+        magic, size, mtime_ns = INDEX_HEADER.unpack(header)[:3]
+        stat = os.fstat(self.file.fileno())
+        return magic == INDEX_MAGIC and size == stat.st_size and mtime_ns == stat.st_mtime_ns
+
+    def build_index(self):
+        """Write the offset index and SKU hash table in one pass over the catalog."""
+        data = self.data
+        size = len(data)
+
+        # Pass 1: row offsets, written straight to the index file
+        header_rows = 1 if data[:5] == b'SKU, ' else 0
+        temporary = f"{self.index_filename}.tmp"
+        with open(temporary, 'w+b') as index:
+            index.write(b'\0' * INDEX_HEADER.size)
+            offsets = bytearray()
+            lines = 0
+            position = 0
+            while position < size:
+                offsets += struct.pack('<Q', position)
+                end = data.find(b'\n', position)
+                position = size if end < 0 else end + 1
+                lines += 1
+                if len(offsets) >= 1 << 20:
+                    index.write(offsets)
+                    offsets.clear()
+            offsets += struct.pack('<Q', size)
+            index.write(offsets)
+
+            rows = max(lines - header_rows, 0)
+            slot_count = 1
+            while slot_count < 2 * rows:
+                slot_count <<= 1
+            table_offset = INDEX_HEADER.size + 8 * (lines + 1)
+            index.truncate(table_offset + 8 * slot_count)
+
+            # Pass 2: fill the hash table in place; the first occurrence of a SKU wins
+            index.flush()
+            table = mmap.mmap(index.fileno(), 0)
+            slots = memoryview(table)[table_offset:].cast('Q')
+            row_offsets = memoryview(table)[INDEX_HEADER.size:table_offset].cast('Q')
+            mask = slot_count - 1
+            for row_index in range(rows):
+                start = row_offsets[header_rows + row_index]
+                end = row_offsets[header_rows + row_index + 1]
+                key = self.row_key(data[start:end].rstrip(b'\n'))
+                slot = sku_hash(key) & mask
+                while slots[slot]:
+                    other = slots[slot] - 1
+                    other_start = row_offsets[header_rows + other]
+                    other_end = row_offsets[header_rows + other + 1]
+                    if self.row_key(data[other_start:other_end].rstrip(b'\n')) == key:
+                        break
+                    slot = (slot + 1) & mask
+                else:
+                    slots[slot] = row_index + 1
+            slots.release()
+            row_offsets.release()
+
+            stat = os.fstat(self.file.fileno())
+            table[:INDEX_HEADER.size] = INDEX_HEADER.pack(
+                INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, header_rows, rows, slot_count
+            )
+            table.flush()
+            table.close()
+        os.replace(temporary, self.index_filename)
+
+    def open_index(self):
+        self.index_file = open(self.index_filename, 'rb')
+        self.index = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        _, _, _, self.header_rows, self.rows, self.slot_count = INDEX_HEADER.unpack(self.index[:INDEX_HEADER.size])
+        table_offset = INDEX_HEADER.size + 8 * (self.header_rows + self.rows + 1)
+        self.offsets = memoryview(self.index)[INDEX_HEADER.size:table_offset].cast('Q')
+        self.slots = memoryview(self.index)[table_offset:].cast('Q')
+
+
+def sku_hash(key):
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Look up rows in a generated catalog without loading it.")
+    parser.add_argument('filename', help="catalog written by price.py, sku.py or sku-new.py")
+    parser.add_argument('--row', type=int, action='append', default=[], help="print row N (0-based)")
+    parser.add_argument('--sku', action='append', default=[], help="print the row for this SKU")
+    args = parser.parse_args()
+
+    with CatalogReader(args.filename) as reader:
+        print(f"{len(reader)} rows in {args.filename}")
+        for index in args.row:
+            print(reader.row(index))
+        for sku in args.sku:
+            row = reader.find(sku)
+            print(row if row is not None else f"{sku} not found")
+
+
+if __name__ == '__main__':
+    main()
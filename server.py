@@ -0,0 +1,244 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from price import GenerateSku, load_generator, prepare_sets
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed'}
+
+# (generator, sets, required sets) of this worker process, set up by start_worker
+worker = None
+
+
+class CatalogService:
+    """Serve a price.py catalog over HTTP from an asyncio event loop.
+
+    Rows are produced in fixed pages with GenerateSku.generate_range, which starts
+    at any offset without walking the rows before it. Generation is CPU bound, so
+    pages and stats are built in worker processes, each with its own generator
+    from start_worker, and the loop keeps answering other requests meanwhile. A
+    custom executor must run start_worker in its workers the same way. Finished
+    pages (as encoded NDJSON lines) are kept in an LRU cache shared by every
+    request, and concurrent requests for the same page wait on the same future.
+
+    Endpoints:
+        GET /count                          {"count": N}
+        GET /stats                          price.py price_stats
+        GET /page?offset=N&limit=M          {"offset", "count", "rows": [...]}
+        GET /skus?start=N&stop=M            chunked NDJSON, one row per line
+        GET /                               index.html
+    """
+
+    def __init__(self, sku_generator, sets, required_sets, page_size=1000, cache_pages=256, executor=None):
+        self.sku_generator = sku_generator.build_index(sets, required_sets)
+        self.sets = sets
+        self.required_sets = required_sets
+        self.page_size = page_size
+        self.cache_pages = cache_pages
+        # Workers are spawned rather than forked, as a forked worker would inherit
+        # the open client sockets and keep those connections from closing
+        self.executor = executor or ProcessPoolExecutor(
+            max_workers=min(4, os.cpu_count() or 1), mp_context=multiprocessing.get_context('spawn'),
+            initializer=start_worker,
+            initargs=(sku_generator.catalog or sku_generator.attributes, sku_generator.options, sets, required_sets),
+        )
+        self.pages = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def page(self, number):
+        """Return the encoded lines of a page, from the cache when possible."""
+        future = self.pages.get(number)
+        if future is not None:
+            self.hits += 1
+            self.pages.move_to_end(number)
+            return await future
+
+        self.misses += 1
+        loop = asyncio.get_running_loop()
+        start = number * self.page_size
+        future = loop.run_in_executor(self.executor, build_page, start, start + self.page_size)
+        self.pages[number] = future
+        while len(self.pages) > self.cache_pages:
+            self.pages.popitem(last=False)
+        try:
+            return await future
+        except Exception:
+            if self.pages.get(number) is future:
+                del self.pages[number]
+            raise
+
+    async def rows(self, start, stop):
+        """Yield blocks of encoded lines covering rows [start, stop)."""
+        start = max(start, 0)
+        stop = min(stop, len(self.sku_generator))
+        while start < stop:
+            number, skip = divmod(start, self.page_size)
+            lines = await self.page(number)
+            block = lines[skip:skip + stop - start]
+            if not block:
+                return
+            yield block
+            start += len(block)
+
+    async def handle(self, reader, writer):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass  # Headers aren't used
+            parts = request.decode('latin1').split()
+            if len(parts) != 3:
+                await self.send_json(writer, 400, {'error': 'malformed request'})
+                return
+            method, target, _ = parts
+            if method != 'GET':
+                await self.send_json(writer, 405, {'error': f'{method} is not supported'})
+                return
+            url = urlsplit(target)
+            query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            await self.route(writer, url.path, query)
+        except ValueError as e:
+            await self.send_json(writer, 400, {'error': str(e)})
+        except ConnectionError:
+            pass  # Client went away mid-stream
+        finally:
+            writer.close()
+
+    async def route(self, writer, path, query):
+        total = len(self.sku_generator)
+        if path == '/count':
+            await self.send_json(writer, 200, {'count': total})
+        elif path == '/stats':
+            loop = asyncio.get_running_loop()
+            stats = await loop.run_in_executor(self.executor, price_stats)
+            await self.send_json(writer, 200, stats)
+        elif path == '/page':
+            offset = query_int(query, 'offset', 0)
+            limit = min(query_int(query, 'limit', self.page_size), self.page_size)
+            lines = []
+            async for block in self.rows(offset, offset + limit):
+                lines.extend(block)
+            body = b'{"offset": %d, "count": %d, "rows": [' % (offset, total) + b', '.join(
+                line.rstrip(b'\n') for line in lines
+            ) + b']}'
+            await self.send(writer, 200, 'application/json', body)
+        elif path == '/skus':
+            start = query_int(query, 'start', 0)
+            stop = query_int(query, 'stop', total)
+            await self.stream(writer, start, stop)
+        elif path in ('/', '/index.html'):
+            with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'index.html'), 'rb') as file:
+                await self.send(writer, 200, 'text/html; charset=utf-8', file.read())
+        else:
+            await self.send_json(writer, 404, {'error': f'no such endpoint {path}'})
+
+    async def stream(self, writer, start, stop):
+        """Send rows [start, stop) as chunked NDJSON, one chunk per page.
+
+        drain() after every chunk holds generation back while a slow client
+        catches up, so a stream only keeps one page in flight.
+        """
+        writer.write(self.headers(200, 'application/x-ndjson', chunked=True))
+        async for block in self.rows(start, stop):
+            chunk = b''.join(block)
+            writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            await writer.drain()
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+
+    def headers(self, status, content_type, length=None, chunked=False):
+        lines = [
+            f"HTTP/1.1 {status} {STATUS_TEXT[status]}",
+            f"Content-Type: {content_type}",
+            "Access-Control-Allow-Origin: *",
+            "Connection: close",
+        ]
+        if chunked:
+            lines.append("Transfer-Encoding: chunked")
+        else:
+            lines.append(f"Content-Length: {length}")
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin1')
+
+    async def send(self, writer, status, content_type, body):
+        writer.write(self.headers(status, content_type, len(body)) + body)
+        await writer.drain()
+
+    async def send_json(self, writer, status, data):
+        await self.send(writer, status, 'application/json', json.dumps(data).encode())
+
+    async def serve(self, host='127.0.0.1', port=8000):
+        server = await asyncio.start_server(self.handle, host, port)
+        address = server.sockets[0].getsockname()
+        print(f"Serving {len(self.sku_generator)} SKUs on http://{address[0]}:{address[1]}/")
+        async with server:
+            await server.serve_forever()
+
+
+def start_worker(source, options, sets, required_sets):
+    """Build the generator a worker process prices its pages with (executor initializer)."""
+    global worker
+    sku_generator = GenerateSku(source)
+    sku_generator.options.update(options)
+    worker = (sku_generator.build_index(sets, required_sets), sets, required_sets)
+
+
+def build_page(start, stop):
+    """Encode rows [start, stop) as NDJSON lines (runs in a worker process)."""
+    sku_generator = worker[0]
+    uppercase = sku_generator.options['uppercase']
+    return [
+        (json.dumps({'sku': sku.upper() if uppercase else sku.lower(), **price}) + '\n').encode()
+        for sku, price in sku_generator.generate_range(start, stop)
+    ]
+
+
+def price_stats():
+    """price_stats of the served catalog (runs in a worker process)."""
+    sku_generator, sets, required_sets = worker
+    return sku_generator.price_stats(sets, required_sets)
+
+
+def query_int(query, name, default):
+    if name not in query:
+        return default
+    try:
+        value = int(query[name])
+    except ValueError:
+        raise ValueError(f"{name} must be an integer") from None
+    if value < 0:
+        raise ValueError(f"{name} must not be negative")
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve generated SKUs and prices over HTTP.")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8000, help="port to listen on (default: 8000)")
+    parser.add_argument('--data', metavar='PATH',
+                        help="load attributes and options from a data.json catalog instead of the built-in ones")
+    parser.add_argument('--page-size', type=int, default=1000, metavar='ROWS',
+                        help="rows per cached page (default: 1000)")
+    parser.add_argument('--cache-pages', type=int, default=256, metavar='N',
+                        help="finished pages kept in memory (default: 256)")
+    args = parser.parse_args()
+
+    try:
+        sku_generator = load_generator(args.data)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        return
+    sets, required_sets = prepare_sets(sku_generator.attributes)
+    service = CatalogService(sku_generator, sets, required_sets, args.page_size, args.cache_pages)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
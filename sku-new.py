@@ -1,16 +1,41 @@
+import argparse
 import psutil
 import os
-import threading
-import time
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from itertools import product, combinations
 from datetime import datetime
 
+from budget import MemoryBudget, MemoryBudgetExceeded
+from catalog import load_catalog
+from checkpoint import Checkpointer, remove_checkpoint, resume_output, run_key
+from generation import (
+    BlockWriter, add_checkpoint_arguments, add_estimate_arguments, add_output_arguments, add_progress_arguments,
+    build_layers, check_estimate, close_progress, layer_chars, layered_at, layered_from, layered_index,
+    layered_pieces, measure_rate, mixed_radix, open_progress, product_from, product_pieces, sampled_progress,
+    stop_for_budget, walk_position
+)
+
 
 class GenerateSku:
+    # Most suffix rows write_product precomputes for the innermost attributes
+    TAIL_ROWS = 256
+
     def __init__(self, attributes, options):
         self.attributes = attributes
         self.options = options
         self.root_node = 'Test-'
+        # One handle for the per-row memory column, not one per SKU
+        self.process = psutil.Process(os.getpid())
+        # Filled in by build_index; until then len() is 0
+        self.required_sets = []
+        self.optional_sets = []
+        self.required_positions = []
+        self.layers = None
+        self.block_size = 1
+        self.total = 0
+        # Bytes write_combinations buffers per write; relieve() halves it
+        self.buffer_bytes = 1024 * 1024
 
     def __del__(self):
         del self.attributes
@@ -57,26 +82,304 @@ class GenerateSku:
             if required_part:
                 yield base_sku
 
-    def get_memory_usage(self):
-        process = psutil.Process(os.getpid())
-        return f"{process.memory_info().rss / 1024 ** 2:.2f} MB"
+    def generate_from(self, required_sets, optional_sets, start):
+        """Yield generate_combinations() from position start on, without walking the SKUs before it."""
+        if not required_sets:
+            if not optional_sets and start == 0:
+                yield self.root_node
+            return
+        if start >= self.count(required_sets, optional_sets):
+            return
+
+        # Every required combination is followed by the same block of SKUs
+        layers = build_layers(optional_sets)
+        block_size = sum(layers['counts']) + 1 if optional_sets else 1
+        required_index, offset = divmod(start, block_size)
+        positions = mixed_radix(required_index, [len(values) for values in required_sets])
+        for required_combination in product_from(required_sets, positions):
+            base_sku = f"{self.root_node}{'-'.join(required_combination)}"
+            for optional_combination in layered_from(layers, offset):
+                yield f"{base_sku}-{'-'.join(optional_combination)}"
+            yield base_sku
+            offset = 0
+
+    def walk_position(self, index):
+        """Return the required value positions, optional subset number and value positions of index, for checkpoints.
+
+        Uses the sets from build_index().
+        """
+        if index >= self.total:
+            return {'required': [], **walk_position(self.layers, sum(self.layers['counts']))}
+        required_index, offset = divmod(index, self.block_size)
+        required = mixed_radix(required_index, [len(values) for values in self.required_sets])
+        return {'required': required, **walk_position(self.layers, offset)}
+
+    def write_combinations(self, required_sets, optional_sets, write, buffer_bytes=1024 * 1024, start=0):
+        """Write generate_combinations' SKUs as newline-terminated bytes, in the same order.
+
+        SKUs are assembled from pre-encoded segments without building a str per row:
+        see write_product. Rows collect in a bytearray that is passed to write(block)
+        whenever it reaches buffer_bytes (halved by relieve()). With start, the walk
+        begins at that position, as in generate_from. Returns the number of rows
+        written.
+        """
+        root = self.root_node.encode()
+        self.buffer_bytes = buffer_bytes
+        if not required_sets:
+            if not optional_sets and start == 0:
+                write(root + b'\n')
+                return 1
+            return 0  # generate_combinations yields nothing without required attributes
+        if start >= self.count(required_sets, optional_sets):
+            return 0
+
+        buffer = bytearray()
+        required = encode_segments(required_sets, first=True)
+        if not optional_sets:
+            pieces = [required]
+            if start:
+                pieces = product_pieces(required, mixed_radix(start, [len(values) for values in required]))
+            rows = 0
+            for piece in pieces:
+                rows += self.write_product(buffer, root, piece, write)
+            if buffer:
+                write(buffer)
+            return rows
+
+        optional = encode_segments(optional_sets)
+        subsets = [
+            subset
+            for subset_size in range(1, len(optional) + 1)
+            for subset in combinations(optional, subset_size)
+        ]
+        rows = 0
+        required_combinations = product(*required)
+        if start:
+            # Finish the block the walk stopped in, then carry on from the next required combination
+            layers = build_layers(optional)
+            required_index, offset = divmod(start, sum(layers['counts']) + 1)
+            required_combinations = product_from(
+                required, mixed_radix(required_index, [len(values) for values in required])
+            )
+            if offset:
+                base_sku = root + b''.join(next(required_combinations))
+                for piece in layered_pieces(layers, offset):
+                    rows += self.write_product(buffer, base_sku, piece, write)
+                buffer += base_sku
+                buffer += b'\n'
+                rows += 1
+        for required_combination in required_combinations:
+            base_sku = root + b''.join(required_combination)
+            for subset in subsets:
+                rows += self.write_product(buffer, base_sku, subset, write)
+            if base_sku != root:
+                buffer += base_sku
+                buffer += b'\n'
+                rows += 1
+        if buffer:
+            write(buffer)
+        return rows
+
+    def write_product(self, buffer, head, segments, write):
+        """Append head + one segment of each list + newline, for every combination.
+
+        prefixes[depth] holds the SKU up to depth, so stepping to the next
+        combination only rebuilds the prefixes from the attribute that changed. The
+        innermost attributes (up to TAIL_ROWS combinations) are precomputed as
+        suffixes and appended in one join against the shared prefix.
+        buffer is handed to write() and cleared once it reaches self.buffer_bytes.
+        """
+        if not all(segments):
+            return 0
+        # Fold the trailing attributes into one list of suffixes so each join emits many rows
+        last = len(segments) - 1
+        tails = [segment + b'\n' for segment in segments[last]]
+        while last > 0 and len(tails) * len(segments[last - 1]) <= self.TAIL_ROWS:
+            last -= 1
+            tails = [segment + tail for segment in segments[last] for tail in tails]
+        sizes = [len(values) for values in segments]
+        positions = [0] * last
+        prefixes = [head]
+        for depth in range(last):
+            prefixes.append(prefixes[depth] + segments[depth][0])
+
+        rows = 0
+        while True:
+            prefix = prefixes[last]
+            buffer += prefix
+            buffer += prefix.join(tails)
+            rows += len(tails)
+            if len(buffer) >= self.buffer_bytes:
+                write(buffer)
+                buffer.clear()
+
+            # Advance the odometer and rebuild the prefixes below the changed depth
+            depth = last - 1
+            while depth >= 0:
+                positions[depth] += 1
+                if positions[depth] < sizes[depth]:
+                    break
+                positions[depth] = 0
+                depth -= 1
+            if depth < 0:
+                return rows
+            for changed in range(depth, last):
+                prefixes[changed + 1] = prefixes[changed] + segments[changed][positions[changed]]
 
+    def relieve(self):
+        """Backpressure for write_combinations: halve the write buffer and the suffix cache."""
+        if self.buffer_bytes <= MemoryBudget.MIN_BUFFER_SIZE and self.TAIL_ROWS <= 1:
+            return False
+        self.buffer_bytes = max(MemoryBudget.MIN_BUFFER_SIZE, self.buffer_bytes // 2)
+        self.TAIL_ROWS = max(1, self.TAIL_ROWS // 2)
+        return True
+
+    def build_index(self, required_sets, optional_sets):
+        """Precompute the counts behind len(), sku_at() and index_of() for these sets."""
+        self.required_sets = [list(values) for values in required_sets]
+        self.optional_sets = [list(values) for values in optional_sets]
+        self.required_positions = []
+        for values in self.required_sets:
+            first_positions = {}
+            for position, value in enumerate(values):
+                first_positions.setdefault(value, position)
+            self.required_positions.append(first_positions)
+        self.layers = build_layers(self.optional_sets)
+
+        # Every required combination is followed by the same block of SKUs
+        if not self.optional_sets:
+            self.block_size = 1
+        else:
+            self.block_size = sum(self.layers['counts']) + 1
+
+        self.total = self.count(self.required_sets, self.optional_sets)
+        return self
+
+    def __len__(self):
+        return self.total
+
+    def sku_at(self, index):
+        """Return the SKU generate_combinations(required_sets, optional_sets) yields at index."""
+        if index < 0:
+            index += self.total
+        if not 0 <= index < self.total:
+            raise IndexError("SKU index out of range")
+        if not self.required_sets and not self.optional_sets:
+            return self.root_node
+
+        required_index, index = divmod(index, self.block_size)
+        required_combination = [None] * len(self.required_sets)
+        for slot in range(len(self.required_sets) - 1, -1, -1):
+            required_index, position = divmod(required_index, len(self.required_sets[slot]))
+            required_combination[slot] = self.required_sets[slot][position]
+
+        required_part = "-".join(required_combination)
+        base_sku = f"{self.root_node}{required_part}" if required_part else self.root_node
+        if not self.optional_sets or index == self.block_size - 1:
+            return base_sku
+        return f"{base_sku}-{'-'.join(layered_at(self.layers, index))}"
+
+    def index_of(self, sku):
+        """Return the position of the first occurrence of sku in generate_combinations()."""
+        if not sku.startswith(self.root_node):
+            raise ValueError(f"{sku!r} is not a generated SKU")
+        rest = sku[len(self.root_node):]
+        if not self.required_sets:
+            if not self.optional_sets and not rest and self.total:
+                return 0
+            raise ValueError(f"{sku!r} is not a generated SKU")
+
+        segments = rest.split("-")
+        required_count = len(self.required_sets)
+        required_index = 0
+        for slot in range(required_count):
+            position = self.required_positions[slot].get(segments[slot]) if slot < len(segments) else None
+            if position is None:
+                raise ValueError(f"{sku!r} is not a generated SKU")
+            required_index = required_index * len(self.required_sets[slot]) + position
+
+        optional_segments = segments[required_count:]
+        if not optional_segments:
+            return required_index * self.block_size + self.block_size - 1
+        if not self.optional_sets:
+            raise ValueError(f"{sku!r} is not a generated SKU")
+
+        index = layered_index(self.layers, optional_segments)
+        if index is None:
+            raise ValueError(f"{sku!r} is not a generated SKU")
+        return required_index * self.block_size + index
+
+
+    def count(self, required_sets, optional_sets):
+        """Return the exact number of SKUs generate_combinations() yields."""
+        # Without required sets the walk only yields the bare root node, if anything
+        if not required_sets and not optional_sets:
+            return 1
+        if not required_sets:
+            return 0
+        required_count = 1
+        for values in required_sets:
+            required_count *= len(values)
+        if not optional_sets:
+            return required_count
+        return required_count * (sum(build_layers(optional_sets)['counts']) + 1)
+
+    def output_bytes(self, required_sets, optional_sets):
+        """Return the bytes generate_combinations() produces, one SKU per line."""
+        root = len(self.root_node.encode())
+        if not required_sets and not optional_sets:
+            return root + 1
+        if not required_sets:
+            return 0
 
-def memory_monitor(limit_mb):
-    """Monitor memory usage and terminate the program if it exceeds the limit."""
-    process = psutil.Process(os.getpid())
-    limit_bytes = limit_mb * 1024 * 1024
-    while True:
-        mem_usage = process.memory_info().rss
-        if mem_usage > limit_bytes:
-            print(f"Memory limit exceeded: {mem_usage / 1024**2:.2f} MB (Limit: {limit_mb} MB)")
-            os._exit(1)  # Forcefully terminate the program
-        time.sleep(1)  # Check memory usage every second
+        required_count = 1
+        for values in required_sets:
+            required_count *= len(values)
+        if not required_count:
+            return 0
 
+        # Every required combination once: root, values and separators
+        base_bytes = required_count * (root + len(required_sets) - 1)
+        for values in required_sets:
+            base_bytes += sum(len(value.encode()) for value in values) * (required_count // len(values))
+        if not optional_sets:
+            return base_bytes + required_count
+
+        # Each required SKU repeats once per optional SKU, plus once on its own
+        counts, chars = layer_chars(optional_sets)
+        block_size = sum(counts[1:]) + 1
+        optional_bytes = sum(chars[k] + counts[k] * k for k in range(1, len(optional_sets) + 1))
+        return block_size * base_bytes + required_count * optional_bytes + required_count * block_size
+
+
+    def estimate(self, required_sets, optional_sets, row_overhead=0, rows_per_second=None, format_row=None):
+        """Project rows, output bytes and runtime before generating anything.
+
+        row_overhead is the bytes each output row adds around the SKU (timestamp,
+        memory column). Without rows_per_second, the rate is measured on a short
+        sample of the real walk, formatted with format_row when given.
+        """
+        rows = self.count(required_sets, optional_sets)
+        if rows_per_second is None:
+            rows_per_second = measure_rate(self.generate_combinations(required_sets, optional_sets), format_row)
+        return {
+            'rows': rows,
+            'bytes': self.output_bytes(required_sets, optional_sets) + rows * row_overhead,
+            'seconds': rows / rows_per_second if rows_per_second else 0.0,
+            'rowsPerSecond': rows_per_second,
+        }
+
+    def get_memory_usage(self):
+        return f"{self.process.memory_info().rss / 1024 ** 2:.2f} MB"
+
+
+def encode_segments(sets, first=False):
+    """Encode attribute values as SKU segments: "-value", or bare "value" for the first set."""
+    return [
+        [(value if first and position == 0 else f"-{value}").encode() for value in values]
+        for position, values in enumerate(sets)
+    ]
 
-# Start memory monitor in a separate thread
-limit_mb = 500  # Set the memory limit to 500 MB
-threading.Thread(target=memory_monitor, args=(limit_mb,), daemon=True).start()
 
 # Example usage
 # Attributes setup
@@ -401,27 +704,191 @@ attributes = [
 
 options = {}
 
-sku_generator = GenerateSku(attributes, options)
 
-# Extract required and optional attribute values
-required_sets, optional_sets = sku_generator.extract_values()
+def format_entry(sku_generator, combination, sampled=False):
+    # With sampled progress the time and memory go to the progress stream instead
+    if sampled:
+        return combination
+    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    memory_usage = sku_generator.get_memory_usage()
+    return f"{current_time} | {combination} | {memory_usage}"
 
-# Get the current timestamp
-timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 
-# Open a file to write the combinations with the timestamp in the filename
-filename = f'output/python-sku.txt'
-try:
-    with open(filename, 'w') as file:
+def generate_shard(shard_filename, attributes, options, required_sets, optional_sets, sampled, batch_rows, buffer_size):
+    """Worker: write the SKUs for a slice of the first required attribute to a shard file."""
+    sku_generator = GenerateSku(attributes, options)
+    if sampled:
+        with open(shard_filename, 'wb', buffering=buffer_size) as shard:
+            sku_generator.write_combinations(required_sets, optional_sets, shard.write, buffer_size)
+        return shard_filename
+    with open(shard_filename, 'w', buffering=buffer_size) as shard:
+        writer = BlockWriter(shard, echo=False, batch_rows=batch_rows)
         for combination in sku_generator.generate_combinations(required_sets, optional_sets):
-            current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            memory_usage = sku_generator.get_memory_usage()
-            log_entry = f"{current_time} | {combination} | {memory_usage}\n"
+            writer.write(format_entry(sku_generator, combination, sampled))
+        writer.flush()
+    return shard_filename
+
+
+def write_sharded(writer, filename, sku_generator, required_sets, optional_sets, workers, buffer_size, progress=None):
+    """Split on the first required attribute's values and append the shards in serial order.
+
+    Every value of the first required attribute owns an equally sized, contiguous
+    block of the output, so contiguous value ranges make balanced shards.
+    """
+    lead_values = required_sets[0]
+    shard_count = min(workers, len(lead_values))
+    bounds = [len(lead_values) * i // shard_count for i in range(shard_count + 1)]
+    shard_filenames = [f"{filename}.part{i}" for i in range(shard_count)]
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    generate_shard, shard_filename, sku_generator.attributes, sku_generator.options,
+                    [lead_values[bounds[i]:bounds[i + 1]]] + required_sets[1:], optional_sets,
+                    progress is not None, writer.batch_rows, buffer_size
+                )
+                for i, shard_filename in enumerate(shard_filenames)
+            ]
+            try:
+                for future in futures:
+                    with open(future.result(), 'r') as shard:
+                        # Hand over whole rows only, so checkpoints never end inside a row
+                        partial = ''
+                        for block in iter(lambda: shard.read(buffer_size), ''):
+                            block = partial + block
+                            end = block.rfind('\n') + 1
+                            partial = block[end:]
+                            if not end:
+                                continue
+                            writer.write_block(block[:end])
+                            if progress is not None:
+                                progress.update(block.count('\n'))
+            except MemoryBudgetExceeded:
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        for shard_filename in shard_filenames:
+            if os.path.exists(shard_filename):
+                os.remove(shard_filename)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate SKUs from required and optional attributes.")
+    parser.add_argument('--workers', type=int, default=1, help="number of worker processes (default: 1)")
+    parser.add_argument('--data', metavar='PATH',
+                        help="load the attributes from a data.json catalog instead of the built-in ones")
+    add_output_arguments(parser, memory_limit=500)
+    add_progress_arguments(parser)
+    add_checkpoint_arguments(parser)
+    add_estimate_arguments(parser)
+    args = parser.parse_args()
+
+    source_attributes = attributes
+    if args.data:
+        try:
+            source_attributes = load_catalog(args.data).attributes()
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            return
+
+    sku_generator = GenerateSku(source_attributes, options)
+    sampled = sampled_progress(args)
+
+    # Extract required and optional attribute values
+    required_sets, optional_sets = sku_generator.extract_values()
+
+    # Size the run before starting it
+    if args.estimate or args.max_rows is not None or args.max_bytes is not None:
+        sample = next(sku_generator.generate_combinations(required_sets, optional_sets), '')
+        row_overhead = len(format_entry(sku_generator, sample, sampled).encode()) - len(sample.encode())
+        estimate = sku_generator.estimate(
+            required_sets, optional_sets, row_overhead,
+            format_row=lambda sku: format_entry(sku_generator, sku, sampled)
+        )
+        if not check_estimate(args, estimate):
+            return
+
+    # Size the buffers and the suffix cache from the memory budget; writes check it after every block
+    try:
+        budget = MemoryBudget(args.memory_limit)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    buffer_size = args.buffer_size or budget.buffer_size()
+    batch_rows = args.batch_rows or budget.batch_rows()
+    sku_generator.TAIL_ROWS = budget.cache_items(MemoryBudget.ROW_BYTES, GenerateSku.TAIL_ROWS)
+
+    progress = open_progress(args)
+
+    # Open a file to write the combinations
+    filename = f'output/python-sku.txt'
+
+    # Checkpoints record the walk position; --resume truncates the file back to the last one
+    sku_generator.build_index(required_sets, optional_sets)
+    run = run_key(required_sets, optional_sets, sku_generator.root_node, sampled)
+
+    start = 0
+    if args.resume:
+        try:
+            start = resume_output(filename, run, sku_generator.walk_position)['rows']
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            close_progress(progress)
+            return
+        print(f"Resuming after {start} rows", file=sys.stderr)
+
+    try:
+        with open(filename, 'a' if args.resume else 'w', buffering=buffer_size) as file:
+            checkpointer = Checkpointer(file, filename, args.checkpoint_every, sku_generator.walk_position, run)
+            writer = BlockWriter(file, echo=not args.quiet, batch_rows=batch_rows, budget=budget, checkpoint=checkpointer)
+            writer.rows_written = start
+            if progress is not None and start:
+                progress.update(start)
+            try:
+                # Shards split the first required attribute's values; without any, or when resuming, run serially
+                if args.workers > 1 and required_sets and required_sets[0] and not start:
+                    write_sharded(
+                        writer, filename, sku_generator, required_sets, optional_sets,
+                        args.workers, buffer_size, progress
+                    )
+                elif sampled:
+                    # Rows are bare SKUs, so they can be assembled and written as bytes
+                    def relieve():
+                        file.flush()
+                        return sku_generator.relieve()
+
+                    def write_block(block):
+                        file.buffer.write(block)
+                        if not args.quiet:
+                            sys.stdout.buffer.write(block)
+                        rows = block.count(b'\n')
+                        writer.rows_written += rows
+                        progress.update(rows)
+                        checkpointer.update(writer.rows_written)
+                        budget.check(relieve)
+
+                    sku_generator.write_combinations(required_sets, optional_sets, write_block, buffer_size, start)
+                else:
+                    if start:
+                        skus = sku_generator.generate_from(required_sets, optional_sets, start)
+                    else:
+                        skus = sku_generator.generate_combinations(required_sets, optional_sets)
+                    for combination in skus:
+                        # Write to file, and print to console unless --quiet
+                        writer.write(format_entry(sku_generator, combination, sampled))
+                        if progress is not None:
+                            progress.update()
+                    writer.flush()
+                remove_checkpoint(filename)
+            except MemoryBudgetExceeded as e:
+                stop_for_budget(e, checkpointer, writer.rows_written)
+    except MemoryError:
+        print("Memory limit exceeded! Exiting the program.")
+    finally:
+        close_progress(progress)
+        print(budget.report(), file=sys.stderr)
 
-            # Write to file
-            file.write(log_entry)
 
-            # Print to console
-            print(log_entry.strip())
-except MemoryError:
-    print("Memory limit exceeded! Exiting the program.")
+if __name__ == '__main__':
+    main()
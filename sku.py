@@ -1,15 +1,30 @@
+import argparse
 import psutil
 import os
-import threading
-import time
+import sys
 from itertools import product, combinations
 from datetime import datetime
 
+from budget import MemoryBudget, MemoryBudgetExceeded
+from catalog import load_catalog
+from checkpoint import Checkpointer, remove_checkpoint, resume_output, run_key
+from generation import (
+    BlockWriter, add_checkpoint_arguments, add_estimate_arguments, add_output_arguments, add_progress_arguments,
+    build_layers, check_estimate, close_progress, layer_chars, layered_at, layered_from, layered_index,
+    measure_rate, open_progress, sampled_progress, stop_for_budget, walk_position
+)
+
 class GenerateSku:
     def __init__(self, attributes, options):
         self.attributes = attributes
         self.options = options
         self.root_node = 'Test-'
+        # One handle for the per-row memory column, not one per SKU
+        self.process = psutil.Process(os.getpid())
+        # Filled in by build_index; until then len() is 0
+        self.sets = []
+        self.layers = None
+        self.total = 0
 
     def __del__(self):
         del self.attributes
@@ -26,33 +41,99 @@ class GenerateSku:
                 for combination in product(*subset):
                     yield self.root_node + '-'.join(combination)
 
-    def get_memory_usage(self):
-        process = psutil.Process(os.getpid())
-        return f"{process.memory_info().rss / 1024 ** 2:.2f} MB"
+    def build_index(self, sets):
+        """Precompute the counts behind len(), sku_at() and index_of() for these sets."""
+        self.sets = [list(values) for values in sets]
+        self.layers = build_layers(self.sets)
+        self.total = sum(self.layers['counts']) if self.sets else 1
+        return self
+
+    def __len__(self):
+        return self.total
+
+    def sku_at(self, index):
+        """Return the SKU generate_combinations(sets) yields at position index."""
+        if index < 0:
+            index += self.total
+        if not 0 <= index < self.total:
+            raise IndexError("SKU index out of range")
+        if not self.sets:
+            return self.root_node
+        return self.root_node + '-'.join(layered_at(self.layers, index))
+
+    def index_of(self, sku):
+        """Return the position of the first occurrence of sku in generate_combinations(sets)."""
+        if not sku.startswith(self.root_node):
+            raise ValueError(f"{sku!r} is not a generated SKU")
+        if not self.sets:
+            if sku == self.root_node and self.total:
+                return 0
+            raise ValueError(f"{sku!r} is not a generated SKU")
+        index = layered_index(self.layers, sku[len(self.root_node):].split('-'))
+        if index is None:
+            raise ValueError(f"{sku!r} is not a generated SKU")
+        return index
+
+
+    def generate_from(self, sets, start):
+        """Yield generate_combinations(sets) from position start on, without walking the SKUs before it."""
+        if not sets:
+            if start == 0:
+                yield self.root_node
+            return
+        for combination in layered_from(build_layers(sets), start):
+            yield self.root_node + '-'.join(combination)
 
+    def count(self, sets):
+        """Return the exact number of SKUs generate_combinations(sets) yields."""
+        if not sets:
+            return 1
+        return sum(build_layers(sets)['counts'])
+
+    def output_bytes(self, sets):
+        """Return the bytes generate_combinations(sets) produces, one SKU per line."""
+        if not sets:
+            return len(self.root_node.encode()) + 1
+        counts, chars = layer_chars(sets)
+        root = len(self.root_node.encode())
+        # Each k-value SKU adds the root, k - 1 separators and a newline to its values
+        return sum(chars[k] + counts[k] * (root + k) for k in range(1, len(sets) + 1))
+
+
+    def estimate(self, sets, row_overhead=0, rows_per_second=None, format_row=None):
+        """Project rows, output bytes and runtime before generating anything.
+
+        row_overhead is the bytes each output row adds around the SKU (timestamp,
+        memory column). Without rows_per_second, the rate is measured on a short
+        sample of the real walk, formatted with format_row when given.
+        """
+        rows = self.count(sets)
+        if rows_per_second is None:
+            rows_per_second = measure_rate(self.generate_combinations(sets), format_row)
+        return {
+            'rows': rows,
+            'bytes': self.output_bytes(sets) + rows * row_overhead,
+            'seconds': rows / rows_per_second if rows_per_second else 0.0,
+            'rowsPerSecond': rows_per_second,
+        }
 
-def memory_monitor(limit_mb):
-    """Monitor memory usage and terminate the program if it exceeds the limit."""
-    process = psutil.Process(os.getpid())
-    limit_bytes = limit_mb * 1024 * 1024
-    while True:
-        mem_usage = process.memory_info().rss
-        if mem_usage > limit_bytes:
-            print(f"Memory limit exceeded: {mem_usage / 1024**2:.2f} MB (Limit: {limit_mb} MB)")
-            os._exit(1)  # Forcefully terminate the program
-        time.sleep(1)  # Check memory usage every second
+    def get_memory_usage(self):
+        return f"{self.process.memory_info().rss / 1024 ** 2:.2f} MB"
 
 
-# Start memory monitor in a separate thread
-limit_mb = 50  # Set the memory limit to 500 MB
-threading.Thread(target=memory_monitor, args=(limit_mb,), daemon=True).start()
+def format_entry(sku_generator, combination, sampled=False):
+    # With sampled progress the time and memory go to the progress stream instead
+    if sampled:
+        return combination
+    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    memory_usage = sku_generator.get_memory_usage()
+    return f"{current_time} | {combination} | {memory_usage}"
 
 
 # Example usage
 attributes = []
 options = {}
 
-sku_generator = GenerateSku(attributes, options)
 sets = [
     ["3030", "3036", "3048", "3630", "3636", "3648", "4230", "4236", "4248", "4830", "4836", "4848", "5430", "5436", "5448", "6030", "6036", "6048"],
     ["Raw", "AMW", "ANW", "BLK", "NAV", "CHO", "ESP", "GRY", "LGRY", "PRM", "SAD", "SGRY", "WHT"],
@@ -66,22 +147,96 @@ sets = [
     ["NRSH", "RSH"]
 ]
 
-# Get the current timestamp
-timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-
-# Open a file to write the combinations with the timestamp in the filename
-filename = f'output/python-sku.txt'
-try:
-    with open(filename, 'w') as file:
-        for combination in sku_generator.generate_combinations(sets):
-            current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            memory_usage = sku_generator.get_memory_usage()
-            log_entry = f"{current_time} | {combination} | {memory_usage}\n"
-
-            # Write to file
-            file.write(log_entry)
-
-            # Print to console
-            print(log_entry.strip())
-except MemoryError:
-    print("Memory limit exceeded! Exiting the program.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate SKUs from every subset of the attribute sets.")
+    parser.add_argument('--data', metavar='PATH',
+                        help="take the attribute sets from a data.json catalog instead of the built-in ones")
+    add_output_arguments(parser, memory_limit=50)
+    add_progress_arguments(parser)
+    add_checkpoint_arguments(parser)
+    add_estimate_arguments(parser)
+    args = parser.parse_args()
+
+    sku_sets = sets
+    if args.data:
+        try:
+            sku_sets = load_catalog(args.data).sets()[0]
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            return
+
+    sku_generator = GenerateSku(attributes, options)
+    sampled = sampled_progress(args)
+
+    # Size the run before starting it
+    if args.estimate or args.max_rows is not None or args.max_bytes is not None:
+        sample = next(sku_generator.generate_combinations(sku_sets), '')
+        row_overhead = len(format_entry(sku_generator, sample, sampled).encode()) - len(sample.encode())
+        estimate = sku_generator.estimate(
+            sku_sets, row_overhead, format_row=lambda sku: format_entry(sku_generator, sku, sampled)
+        )
+        if not check_estimate(args, estimate):
+            return
+
+    # Size the buffers from the memory budget; the writer checks it after every block
+    try:
+        budget = MemoryBudget(args.memory_limit)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    buffer_size = args.buffer_size or budget.buffer_size()
+    batch_rows = args.batch_rows or budget.batch_rows()
+
+    progress = open_progress(args)
+
+    # Open a file to write the combinations
+    filename = f'output/python-sku.txt'
+
+    # Checkpoints record the walk position; --resume truncates the file back to the last one
+    layers = build_layers(sku_sets) if sku_sets else None
+    run = run_key(sku_sets, sku_generator.root_node, sampled)
+
+    def position(rows):
+        return walk_position(layers, rows) if layers else {}
+
+    start = 0
+    if args.resume:
+        try:
+            start = resume_output(filename, run, position)['rows']
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            close_progress(progress)
+            return
+        print(f"Resuming after {start} rows", file=sys.stderr)
+
+    try:
+        with open(filename, 'a' if args.resume else 'w', buffering=buffer_size) as file:
+            checkpointer = Checkpointer(file, filename, args.checkpoint_every, position, run)
+            writer = BlockWriter(file, echo=not args.quiet, batch_rows=batch_rows, budget=budget, checkpoint=checkpointer)
+            writer.rows_written = start
+            if progress is not None and start:
+                progress.update(start)
+            try:
+                if start:
+                    skus = sku_generator.generate_from(sku_sets, start)
+                else:
+                    skus = sku_generator.generate_combinations(sku_sets)
+                for combination in skus:
+                    # Write to file, and print to console unless --quiet
+                    writer.write(format_entry(sku_generator, combination, sampled))
+                    if progress is not None:
+                        progress.update()
+                writer.flush()
+                remove_checkpoint(filename)
+            except MemoryBudgetExceeded as e:
+                stop_for_budget(e, checkpointer, writer.rows_written)
+    except MemoryError:
+        print("Memory limit exceeded! Exiting the program.")
+    finally:
+        close_progress(progress)
+        print(budget.report(), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import json
+import os
+import pickle
+
+import pytest
+
+from catalog import load_catalog
+from price import GenerateSku
+
+DATA = {
+    'options': {'basePrice': '5', 'vat': True, 'vatAmount': 20},
+    'attributes': [
+        {'name': 'Size', 'enabled': True, 'required': True,
+         'values': [{'value': 'S', 'price': '10'}, {'value': 'M', 'price': '12.5'}]},
+        {'name': 'Color', 'enabled': True, 'required': False,
+         'values': [{'value': 'RED', 'price': '0.1'}, {'value': 'BLU', 'price': 0}]},
+        {'name': 'Gift', 'enabled': False, 'required': False,
+         'values': [{'value': 'GFT', 'price': '99.99'}]},
+    ],
+}
+
+
+@pytest.fixture
+def data_filename(tmp_path):
+    filename = tmp_path / 'data.json'
+    filename.write_text(json.dumps(DATA))
+    return str(filename)
+
+
+def cache_filename(data_filename):
+    cache_dir = os.path.join(os.path.dirname(data_filename), '.cache')
+    (name,) = os.listdir(cache_dir)
+    return os.path.join(cache_dir, name)
+
+
+def copy_attributes():
+    return json.loads(json.dumps(DATA['attributes']))
+
+
+def same_catalog(first, second):
+    return all(
+        getattr(first, name) == getattr(second, name)
+        for name in ('source_hash', 'options', 'names', 'values', 'prices', 'flags')
+    )
+
+
+def test_cache_round_trip(data_filename):
+    compiled = load_catalog(data_filename)
+    assert cache_filename(data_filename).endswith('.json')
+    cached = load_catalog(data_filename)
+    assert same_catalog(compiled, cached)
+    assert [prices.typecode for prices in cached.prices] == ['q', 'q', 'q']
+
+
+@pytest.mark.parametrize('content', [b'not json', b'[]', b'{"sourceHash": "0"}', None])
+def test_bad_cache_is_recompiled(data_filename, content):
+    compiled = load_catalog(data_filename)
+    if content is None:
+        # An old pickled cache is never unpickled
+        content = pickle.dumps(compiled)
+    with open(cache_filename(data_filename), 'wb') as cache:
+        cache.write(content)
+    assert same_catalog(load_catalog(data_filename), compiled)
+
+
+def test_generator_prices_from_catalog(data_filename):
+    catalog = load_catalog(data_filename)
+    from_catalog = GenerateSku(catalog)
+    from_attributes = GenerateSku(catalog.attributes())
+    assert from_catalog.catalog is catalog
+    assert from_catalog.cent_tables == from_attributes.cent_tables
+    assert from_catalog.price_tables == from_attributes.price_tables
+
+    # Editing the attributes in place prices from the edited data once invalidated
+    from_catalog.attributes[0]['values'][1]['price'] = '13'
+    from_catalog.invalidate()
+    assert from_catalog.quote({'Size': 'M'})['subtotal'] == 13
+    assert from_catalog.catalog is None
+
+
+def test_generator_keeps_the_callers_attributes():
+    attributes = copy_attributes()
+    generator = GenerateSku(attributes)
+    assert generator.attributes is attributes
+
+    # Edits to the caller's own list take effect once invalidated
+    attributes[1]['values'][0]['price'] = '1'
+    generator.invalidate()
+    assert generator.quote({'Size': 'S', 'Color': 'RED'})['subtotal'] == 11
+
+
+def test_quote_cache():
+    generator = GenerateSku(copy_attributes())
+    quote = generator.quote({'Size': 'M', 'Color': 'RED'})
+    expected = dict(quote)
+
+    # A returned quote is the caller's to modify
+    quote['totalPrice'] = 0
+    assert generator.quote({'Size': 'M', 'Color': 'RED'}) == expected
+    # The selection's order doesn't matter
+    assert generator.quote({'Color': 'RED', 'Size': 'M'}) == expected
+    assert generator.quote_info()['hits'] == 2
+    assert generator.quote_info()['misses'] == 1
@@ -0,0 +1,48 @@
+import pytest
+
+from reader import CatalogReader
+from sku import GenerateSku
+
+SETS = [['S', 'M', 'L'], ['RED', 'BLU'], ['CLT']]
+
+
+@pytest.fixture
+def generator():
+    return GenerateSku([], {}).build_index(SETS)
+
+
+@pytest.fixture
+def catalog_filename(tmp_path, generator):
+    filename = tmp_path / 'python-sku.txt'
+    filename.write_text(''.join(f"{sku}\n" for sku in generator.generate_combinations(SETS)))
+    return str(filename)
+
+
+@pytest.mark.parametrize('ranked', [False, True])
+def test_rows_and_lookups(catalog_filename, generator, ranked):
+    skus = list(generator.generate_combinations(SETS))
+    with CatalogReader(catalog_filename, rank=generator.index_of if ranked else None) as reader:
+        assert len(reader) == len(skus)
+        assert [reader.row(index) for index in range(len(skus))] == skus
+        assert all(reader.index_of(sku) == index for index, sku in enumerate(skus))
+        assert reader.find(skus[-1]) == skus[-1]
+
+
+@pytest.mark.parametrize('ranked', [False, True])
+def test_missing_sku(catalog_filename, generator, ranked):
+    with CatalogReader(catalog_filename, rank=generator.index_of if ranked else None) as reader:
+        assert reader.find('Test-XL') is None
+        with pytest.raises(ValueError):
+            reader.index_of('Test-XL')
+
+
+def test_ranked_sku_past_the_end(tmp_path, generator):
+    # A partial catalog, as a stopped run leaves it: later SKUs rank past its end
+    skus = list(generator.generate_combinations(SETS))
+    filename = tmp_path / 'partial.txt'
+    filename.write_text(''.join(f"{sku}\n" for sku in skus[:4]))
+    with CatalogReader(str(filename), rank=generator.index_of) as reader:
+        assert reader.find(skus[3]) == skus[3]
+        assert reader.find(skus[-1]) is None
+        with pytest.raises(ValueError):
+            reader.index_of(skus[-1])
@@ -0,0 +1,170 @@
+import asyncio
+import json
+
+import pytest
+
+from price import GenerateSku, prepare_sets
+from server import CatalogService
+
+ATTRIBUTES = [
+    {'name': 'Size', 'enabled': True, 'required': True,
+     'values': [{'value': 'S', 'price': '10'}, {'value': 'M', 'price': '12.5'}, {'value': 'L', 'price': '15'}]},
+    {'name': 'Color', 'enabled': True, 'required': False,
+     'values': [{'value': 'Red', 'price': '3'}, {'value': 'Blue', 'price': 0}, {'value': 'Green', 'price': '4.25'}]},
+    {'name': 'Rush', 'enabled': True, 'required': False,
+     'values': [{'value': 'RSH', 'price': '7'}, {'value': 'NRSH', 'price': 0}]},
+]
+
+# 36 rows in pages of 7
+PAGE_SIZE = 7
+
+
+def make_service():
+    generator = GenerateSku(ATTRIBUTES)
+    sets, required_sets = prepare_sets(generator.attributes)
+    expected = [
+        {'sku': sku.upper(), **price} for sku, price in generator.generate_combinations(sets, required_sets)
+    ]
+    return CatalogService(generator, sets, required_sets, page_size=PAGE_SIZE, cache_pages=4), expected
+
+
+async def fetch(port, target, method='GET'):
+    """Send one request to the loopback server; return (status, headers, body)."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f"{method} {target} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    await writer.wait_closed()
+    head, _, body = response.partition(b'\r\n\r\n')
+    status_line, *header_lines = head.decode('latin1').split('\r\n')
+    headers = dict(line.split(': ', 1) for line in header_lines)
+    return int(status_line.split()[1]), headers, body
+
+
+def decode_chunks(body):
+    """Split a chunked transfer-encoded body into its chunks."""
+    chunks = []
+    while True:
+        size_line, _, body = body.partition(b'\r\n')
+        size = int(size_line, 16)
+        if not size:
+            return chunks
+        chunks.append(body[:size])
+        body = body[size + 2:]
+
+
+def run_with_server(service, client):
+    """Start service.handle on a free loopback port and run client(port) against it."""
+    async def main():
+        server = await asyncio.start_server(service.handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            return await client(port)
+
+    try:
+        return asyncio.run(main())
+    finally:
+        service.executor.shutdown()
+
+
+def test_count_and_page():
+    service, expected = make_service()
+
+    async def client(port):
+        status, _, body = await fetch(port, '/count')
+        assert status == 200
+        assert json.loads(body) == {'count': len(expected)}
+
+        # Spans two cached pages
+        status, headers, body = await fetch(port, '/page?offset=5&limit=6')
+        assert status == 200
+        assert headers['Content-Type'] == 'application/json'
+        page = json.loads(body)
+        assert page['offset'] == 5
+        assert page['count'] == len(expected)
+        assert page['rows'] == expected[5:11]
+
+        # limit is capped at one page
+        _, _, body = await fetch(port, f'/page?offset=0&limit={PAGE_SIZE * 3}')
+        assert json.loads(body)['rows'] == expected[:PAGE_SIZE]
+
+        _, _, body = await fetch(port, f'/page?offset={len(expected)}')
+        assert json.loads(body)['rows'] == []
+
+    run_with_server(service, client)
+
+
+def test_skus_streams_one_chunk_per_page():
+    service, expected = make_service()
+
+    async def client(port):
+        status, headers, body = await fetch(port, '/skus?start=3&stop=25')
+        assert status == 200
+        assert headers['Transfer-Encoding'] == 'chunked'
+        chunks = decode_chunks(body)
+        # Rows 3-6 finish page 0, pages 1 and 2 are whole, rows 21-24 start page 3
+        assert [chunk.count(b'\n') for chunk in chunks] == [4, 7, 7, 4]
+        rows = [json.loads(line) for chunk in chunks for line in chunk.splitlines()]
+        assert rows == expected[3:25]
+
+        _, _, body = await fetch(port, '/skus')
+        rows = [json.loads(line) for chunk in decode_chunks(body) for line in chunk.splitlines()]
+        assert rows == expected
+
+    run_with_server(service, client)
+
+
+def test_concurrent_pages_and_stats():
+    service, expected = make_service()
+
+    async def client(port):
+        # Every page at once, each built by a worker with its own generator
+        targets = [f'/page?offset={offset}&limit={PAGE_SIZE}' for offset in range(0, len(expected), PAGE_SIZE)]
+        responses = await asyncio.gather(*(fetch(port, target) for target in targets))
+        rows = [row for _, _, body in responses for row in json.loads(body)['rows']]
+        assert rows == expected
+
+        status, _, body = await fetch(port, '/stats')
+        assert status == 200
+        assert json.loads(body) == service.sku_generator.price_stats(service.sets, service.required_sets)
+
+    run_with_server(service, client)
+
+
+def test_page_cache_counters():
+    service, _ = make_service()
+
+    async def client(port):
+        await fetch(port, f'/page?offset=0&limit={PAGE_SIZE}')
+        assert (service.hits, service.misses) == (0, 1)
+        await fetch(port, '/page?offset=2&limit=3')
+        assert (service.hits, service.misses) == (1, 1)
+        # Page 0 again, then page 1 for the first time
+        await fetch(port, f'/skus?start=0&stop={PAGE_SIZE * 2}')
+        assert (service.hits, service.misses) == (2, 2)
+        assert list(service.pages) == [0, 1]
+
+        # Only cache_pages pages are kept, least recently used first out
+        await fetch(port, f'/skus?start={PAGE_SIZE * 2}')
+        assert len(service.pages) == service.cache_pages
+        assert 0 not in service.pages
+
+    run_with_server(service, client)
+
+
+@pytest.mark.parametrize('target, method, status', [
+    ('/page?offset=-1', 'GET', 400),
+    ('/page?limit=ten', 'GET', 400),
+    ('/missing', 'GET', 404),
+    ('/count', 'POST', 405),
+])
+def test_bad_requests(target, method, status):
+    service, _ = make_service()
+
+    async def client(port):
+        response_status, _, body = await fetch(port, target, method)
+        assert response_status == status
+        assert 'error' in json.loads(body)
+
+    run_with_server(service, client)
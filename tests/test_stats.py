@@ -0,0 +1,54 @@
+import pytest
+
+from price import GenerateSku, format_cents, prepare_sets, print_stats
+
+# Prices whose VAT lands on half cents, so float and cents totals differ
+ATTRIBUTES = [
+    {'name': 'Size', 'enabled': True, 'required': True,
+     'values': [{'value': 'S', 'price': '0.97'}, {'value': 'M', 'price': '1.03'}, {'value': 'L', 'price': '2.11'}]},
+    {'name': 'Color', 'enabled': True, 'required': False,
+     'values': [{'value': 'RED', 'price': '0.33'}, {'value': 'BLU', 'price': 0}]},
+    {'name': 'Trim', 'enabled': True, 'required': False,
+     'values': [{'value': 'CLT', 'price': '0.05'}]},
+]
+
+
+def make_generator(price_mode):
+    generator = GenerateSku(ATTRIBUTES)
+    generator.options.update({'priceMode': price_mode, 'discount': True, 'discountAmount': 7})
+    return generator
+
+
+@pytest.mark.parametrize('price_mode', ['float', 'cents'])
+def test_stats_match_the_rows(price_mode):
+    generator = make_generator(price_mode)
+    sets, required_sets = prepare_sets(generator.attributes)
+    prices = [price for _, price in generator.generate_combinations(sets, required_sets)]
+    totals = [price['totalPrice'] for price in prices]
+
+    # Float stats add the prices in another order; cents stats are exact
+    same = pytest.approx if price_mode == 'float' else int
+    stats = generator.price_stats(sets, required_sets)
+    assert stats['count'] == len(prices)
+    assert stats['minTotalPrice'] == same(min(totals))
+    assert stats['maxTotalPrice'] == same(max(totals))
+    assert stats['minSubtotal'] == same(min(price['subtotal'] for price in prices))
+    assert stats['maxSubtotal'] == same(max(price['subtotal'] for price in prices))
+    assert stats['meanTotalPrice'] == pytest.approx(sum(totals) / len(totals), abs=0.5)
+
+    scale = 100 if price_mode == 'cents' else 1
+    threshold = sorted(totals)[len(totals) // 2] / scale
+    expected = sum(1 for total in totals if total / scale < threshold)
+    assert generator.count_below(sets, required_sets, threshold) == expected
+    assert sum(count for _, _, count in generator.price_histogram(sets, required_sets, 4)) == len(prices)
+
+
+def test_cents_stats_output(capsys):
+    generator = make_generator('cents')
+    sets, required_sets = prepare_sets(generator.attributes)
+    totals = [price['totalPrice'] for _, price in generator.generate_combinations(sets, required_sets)]
+
+    print_stats(generator, sets, required_sets)
+    lines = capsys.readouterr().out.splitlines()
+    mean = format_cents((2 * sum(totals) + len(totals)) // (2 * len(totals)))
+    assert lines[2] == f"Total Price: {format_cents(min(totals))} - {format_cents(max(totals))}, mean {mean}"
@@ -0,0 +1,119 @@
+import pytest
+
+from price import GenerateSku, prepare_sets
+
+# Values are unique across attributes, so a SKU's segments name their attributes.
+# Repeated prices make ties that have to come out in generation order.
+ATTRIBUTES = [
+    {'name': 'Size', 'enabled': True, 'required': True,
+     'values': [{'value': 'S', 'price': '10'}, {'value': 'M', 'price': '12.5'}, {'value': 'L', 'price': '10'}]},
+    {'name': 'Color', 'enabled': True, 'required': False,
+     'values': [{'value': 'RED', 'price': '3'}, {'value': 'BLU', 'price': 0}, {'value': 'GRN', 'price': '3'}]},
+    {'name': 'Gift', 'enabled': False, 'required': False,
+     'values': [{'value': 'GFT', 'price': '99'}]},
+    {'name': 'Trim', 'enabled': True, 'required': True,
+     'values': [{'value': 'CLT', 'price': 0}, {'value': 'FLT', 'price': '2.5'}]},
+    {'name': 'Rush', 'enabled': True, 'required': False,
+     'values': [{'value': 'RSH', 'price': '7'}, {'value': 'NRSH', 'price': 0}]},
+]
+
+VALUE_ATTRIBUTES = {
+    value['value']: attribute['name'] for attribute in ATTRIBUTES for value in attribute['values']
+}
+
+
+def make_generator(price_mode='float', **options):
+    generator = GenerateSku(ATTRIBUTES)
+    generator.options.update(options)
+    generator.options['priceMode'] = price_mode
+    return generator
+
+
+def brute_force(generator, sets, required_sets, k, order, filters=None):
+    """The first k rows of a stable sort of the whole catalog by totalPrice."""
+    rows = list(generator.generate_combinations(sets, required_sets))
+    if filters:
+        def allowed(row):
+            chosen = {VALUE_ATTRIBUTES[value]: value for value in row[0].split('-')[1:]}
+            return all(chosen.get(name) in values for name, values in filters.items())
+        rows = [row for row in rows if allowed(row)]
+    return sorted(rows, key=lambda row: row[1]['totalPrice'], reverse=order == 'desc')[:k]
+
+
+@pytest.mark.parametrize('price_mode', ['float', 'cents'])
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+@pytest.mark.parametrize('k', [1, 5, 17, 1000])
+def test_top_k_matches_sorted_catalog(price_mode, order, k):
+    generator = make_generator(price_mode)
+    sets, required_sets = prepare_sets(generator.attributes)
+    assert generator.top_k(sets, required_sets, k, order) == brute_force(generator, sets, required_sets, k, order)
+
+
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+@pytest.mark.parametrize('filters', [
+    {'Color': ['RED']},
+    {'Color': ['RED', 'GRN'], 'Rush': ['RSH']},
+    {'Size': ['M'], 'Trim': ['FLT']},
+])
+def test_top_k_with_filters(order, filters):
+    generator = make_generator()
+    sets, required_sets = prepare_sets(generator.attributes)
+    expected = brute_force(generator, sets, required_sets, 10, order, filters)
+    assert generator.top_k(sets, required_sets, 10, order, filters) == expected
+
+
+def test_top_k_with_discount_and_base_price():
+    generator = make_generator(basePrice=4, discount=True, discountAmount=20)
+    sets, required_sets = prepare_sets(generator.attributes)
+    for order in ('asc', 'desc'):
+        assert generator.top_k(sets, required_sets, 8, order) == brute_force(generator, sets, required_sets, 8, order)
+
+
+def test_top_k_with_only_optional_attributes():
+    generator = GenerateSku([dict(attribute, required=False) for attribute in ATTRIBUTES])
+    sets, required_sets = prepare_sets(generator.attributes)
+    for order in ('asc', 'desc'):
+        assert generator.top_k(sets, required_sets, 12, order) == brute_force(generator, sets, required_sets, 12, order)
+
+
+def test_top_k_rejects_unknown_filters_and_orders():
+    generator = make_generator()
+    sets, required_sets = prepare_sets(generator.attributes)
+    with pytest.raises(ValueError):
+        generator.top_k(sets, required_sets, 3, filters={'Gift': ['GFT']})
+    with pytest.raises(ValueError):
+        generator.top_k(sets, required_sets, 3, order='sideways')
+    assert generator.top_k(sets, required_sets, 0) == []
+
+
+
+# In floats 0.1 + 0.2 is above 0.3, and a 50% discount takes X-Y (0.03) and X-S (0.02) to the same cent
+DECIMAL_ATTRIBUTES = [
+    {'name': 'Base', 'enabled': True, 'required': True,
+     'values': [{'value': 'P', 'price': '0.1'}, {'value': 'Q', 'price': '0.3'}, {'value': 'X', 'price': '0.02'}]},
+    {'name': 'Extra', 'enabled': True, 'required': True,
+     'values': [{'value': 'R', 'price': '0.2'}, {'value': 'Y', 'price': '0.01'}, {'value': 'S', 'price': 0}]},
+]
+
+
+def decimal_generator(price_mode='float', **options):
+    generator = GenerateSku(DECIMAL_ATTRIBUTES)
+    generator.options.update(priceMode=price_mode, vat=False, **options)
+    return generator
+
+
+def test_top_k_orders_by_float_totals():
+    generator = decimal_generator()
+    sets, required_sets = prepare_sets(generator.attributes)
+    filters = {'Base': ['P', 'Q'], 'Extra': ['R', 'S']}
+    assert [row[0] for row in generator.top_k(sets, required_sets, 2, filters=filters)] == ['Test-P-S', 'Test-Q-S']
+
+
+@pytest.mark.parametrize('price_mode', ['float', 'cents'])
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+@pytest.mark.parametrize('discount', [False, True])
+def test_top_k_with_decimal_prices(price_mode, order, discount):
+    generator = decimal_generator(price_mode, discount=discount, discountAmount=50)
+    sets, required_sets = prepare_sets(generator.attributes)
+    for k in range(1, 10):
+        assert generator.top_k(sets, required_sets, k, order) == brute_force(generator, sets, required_sets, k, order)